@@ -78,39 +78,48 @@ class Window(metaclass=ABCMeta):
 
 
 class Config:
-    """Stores json config and methods for thread safe accessing to it"""
+    """Stores json config of a window or of an entry in the list"""
 
     def __init__(self, config, button=None, path=None, name=''):
         self.name = name
         self.path = path
-        self._config = config
+        self.config = config
         self.button = button
-        self.config_mutex = threading.Lock()
+
+
+class SnapshotConfig:
+    """Part of the proxy snapshots with the same interface as Config.
+    Reading takes the current snapshot without locks,
+    writing publishes a new snapshot with this part changed"""
+
+    def __init__(self, store, field, name=''):
+        self.name = name
+        self.store = store
+        self.field = field
 
     config = property()
 
     @config.getter
     def config(self):
-        with self.config_mutex:
-            return self._config
+        return getattr(self.store.current, self.field)
 
     @config.setter
     def config(self, value):
-        with self.config_mutex:
-            self._config = value
+        self.store.publish(**{self.field: value})
 
 
 class GUI(threading.Thread, Window):
     """Main GUI window and a working thread"""
 
-    def __init__(self, config_json, api_map):
+    def __init__(self, store):
         threading.Thread.__init__(self)
         self.window = None
         self.master = None
         self.subwindow = None
         self.flag_for_delete = False
-        self.config_json = Config(config_json)
-        self.api_map = Config(api_map)
+        self.config_json = SnapshotConfig(store, 'config')
+        self.api_map = SnapshotConfig(store, 'api_map')
+        self.started = threading.Event()  # Set when mainloop runs or Tk fails
         self.start()
 
     def go(self):
@@ -119,7 +128,9 @@ class GUI(threading.Thread, Window):
 
     def close(self):
         """Overrides close of other windows"""
-        self.window.quit()  # Leave mainloop
+        self.started.wait()  # Quit before mainloop would be lost
+        if getattr(self, 'window', None) is not None:
+            self.window.quit()  # Leave mainloop
         proxy_shutdown()
 
     def draw(self):
@@ -133,7 +144,12 @@ class GUI(threading.Thread, Window):
 
     def run(self):
         """This runs as a thread"""
-        self.window = Tk()
+        try:
+            self.window = Tk()
+        finally:
+            if self.window is None:
+                self.started.set()
+        self.window.after(0, self.started.set)
         self.window.protocol("WM_DELETE_WINDOW", self.quit_dialog)
 
         Button(self.window, text="API map",
@@ -167,25 +183,24 @@ class GUI(threading.Thread, Window):
         del self.window
 
 
-class ApiMapWindow(Window):
-    """Window for API map of our addon"""
+class RuleListWindow(Window):
+    """Window with a list of entries filtered by a text field.
+    Listbox draws only its visible rows, so the window opens fast
+    for thousands of entries. Entry is opened by double click or Enter"""
 
-    def __init__(self, master, api_map):
+    def __init__(self, master, entries):
         Window.__init__(self, master)
 
-        self.api_frame = Frame(self.window)
-        self.api_frame.pack(side=TOP)
-
-        self.api_map = api_map
-
-        self.api_list = []
-
-        for api in self.api_map.config:  # Each 'api' is a tuple (json, string_file_name)
-            config = Config(api[0], button=Button(self.api_frame), name=api[1])
-            self.api_list.append(config)
+        self.entries = entries  # Config of each entry
+        self.labels = []  # Texts of entries in the list
+        self.keys = []  # Lower case labels to filter entries
+        self.shown = []  # Indexes of entries shown in the list
+        self.filter_text = ''
 
-        empty_frame = Frame(self.window, height=15)
-        empty_frame.pack(side=TOP)
+        self.filter_var = StringVar(self.window)
+        filter_entry = Entry(self.window, textvariable=self.filter_var)
+        filter_entry.pack(side=TOP, fill=X)
+        self.filter_var.trace_add('write', lambda *_: self.apply_filter())
 
         buttons_frame = Frame(self.window)
         buttons_frame.pack(side=BOTTOM)
@@ -194,72 +209,110 @@ class ApiMapWindow(Window):
         Button(buttons_frame, text="Save",
                command=self.save_and_exit).pack(side=LEFT)
 
+        list_frame = Frame(self.window)
+        list_frame.pack(side=TOP, fill=BOTH, expand=YES)
+        scrollbar = Scrollbar(list_frame, orient=VERTICAL)
+        self.listbox = Listbox(list_frame, width=80, height=25,
+                               activestyle='none',
+                               yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.listbox.yview)
+        scrollbar.pack(side=RIGHT, fill=Y)
+        self.listbox.pack(side=LEFT, fill=BOTH, expand=YES)
+        self.listbox.bind('<Double-Button-1>', lambda _: self.open_selected())
+        self.listbox.bind('<Return>', lambda _: self.open_selected())
+
+        filter_entry.focus_set()
+
+    @abstractmethod
+    def label(self, entry):
+        """Returns text of the entry in the list"""
+
+    @abstractmethod
+    def save_and_exit(self):
+        """Saves new config to parent window then closes this"""
+
+    def draw(self):
+        """Updates labels of all entries and the list, keeping its position"""
+
+        position = self.listbox.yview()[0]
+        self.labels = [self.label(entry) for entry in self.entries]
+        self.keys = [label.lower() for label in self.labels]
+        self.shown = self.matching(range(len(self.entries)))
+        self.show()
+        self.listbox.yview_moveto(position)
+
+    def matching(self, indexes):
+        filter_text = self.filter_text
+        keys = self.keys
+        return [index for index in indexes if filter_text in keys[index]]
+
+    def apply_filter(self):
+        """Filters the list by the text. If the text contains the
+        previous one, only entries shown now are checked"""
+
+        filter_text = self.filter_var.get().lower()
+        if self.filter_text in filter_text:
+            indexes = self.shown
+        else:
+            indexes = range(len(self.entries))
+        self.filter_text = filter_text
+        self.shown = self.matching(indexes)
+        self.show()
+
+    def show(self):
+        self.listbox.delete(0, END)
+        if self.shown:
+            self.listbox.insert(END, *(self.labels[index] for index in self.shown))
+
+    def open_selected(self):
+        """Opens the editor of the selected entry"""
+
+        selection = self.listbox.curselection()
+        if selection:
+            entry = self.entries[self.shown[selection[0]]]
+            self.open_window(ModalWindow, entry)()
+
+
+class ApiMapWindow(RuleListWindow):
+    """Window for API map of our addon"""
+
+    def __init__(self, master, api_map):
+        self.api_map = api_map
+        # Each 'api' is a tuple (json, string_file_name)
+        RuleListWindow.__init__(self, master, [Config(api[0], name=api[1])
+                                               for api in api_map.config])
+
+    def label(self, entry):
+        return entry.name
+
     def save_and_exit(self):
         """Saves new config to parent window then closes this"""
         api_map = []
-        for api in self.api_list:
+        for api in self.entries:
             api_map.append((api.config, api.name))
         self.new_value = api_map
         self.window.destroy()
 
-    def draw(self):
-        """Places new texts and and new commands to buttons"""
-
-        for widget in self.api_frame.winfo_children():
-            widget.pack_forget()
-        for api in self.api_list:
-            api.button.pack_forget()
-            api.button["text"] = api.name
-            api.button["command"] = self.open_window(ModalWindow, api)
-            api.button.pack()
-
 
-class ConfigWindow(Window):
+class ConfigWindow(RuleListWindow):
     """Window that stores rules config that control the behavior of the addon"""
-    def __init__(self, master, config_json):
-        Window.__init__(self, master)
-
-        self.configs_frame = Frame(self.window)
-        self.configs_frame.pack(side=TOP)
 
+    def __init__(self, master, config_json):
         self.config_json = config_json
-        self.rule_list = []
+        RuleListWindow.__init__(self, master, [Config(rule)
+                                               for rule in config_json.config])
 
-        for rule in self.config_json.config:
-            button = Button(self.configs_frame)
-            config = Config(rule, button)
-            self.rule_list.append(config)
-
-        buttons_frame = Frame(self.window)
-        buttons_frame.pack(side=BOTTOM)
-        Button(buttons_frame, text="Close",
-               command=self.close_childs_recursive).pack(side=RIGHT)
-        Button(buttons_frame, text="Save",
-               command=self.save_and_exit).pack(side=LEFT)
+    def label(self, entry):
+        rule = entry.config
+        return (f'{"" if rule.get("is_on", True) else "[off] "}'
+                f'{rule.get("authority_expr", "") or "*"} '
+                f'{rule.get("path_expr", "") or ".*"}')
 
     def save_and_exit(self):
         """Saves new config to parent window then closes this"""
-
-        # TODO: Посмотреть, нельзя ли таки объединить методы под общим соусом
-        config_json = []
-        for rule in self.rule_list:
-            config_json.append(rule.config)
-        self.new_value = config_json
+        self.new_value = [rule.config for rule in self.entries]
         self.window.destroy()
 
-    def draw(self):
-        """Places new texts and and new commands to buttons"""
-
-        # TODO: Посмотреть, нельзя ли таки объединить методы под общим соусом
-
-        for widget in self.configs_frame.winfo_children():
-            widget.pack_forget()
-
-        for rule in self.rule_list:
-            rule.button["text"] = rule.config.get('path_expr', '.*')
-            rule.button["command"] = self.open_window(ModalWindow, rule)
-            rule.button.pack(side=TOP, fill=BOTH)
-
 
 class ModalWindow(Window):
     """Simple modal window with config in text panel and save button"""
@@ -0,0 +1,69 @@
+"""
+Compares addon startup with eager and lazy loading of proto_py.
+Each mode is measured in fresh interpreters: time of importing helper
+(proto_py modules and the message registry) and max RSS of the process.
+
+Run it from the activated venv:
+    python3 benchmarks/proto_loading.py --runs 10 Item Error
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, resource, sys, time
+import mitmproxy.ctx  # Not a part of the measurement
+start = time.perf_counter()
+import helper
+imported = time.perf_counter()
+for name in sys.argv[1:]:
+    helper.registry.find(name)
+resolved = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "resolve_ms": (resolved - imported) * 1000,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+'''
+
+
+def run_probe(mode: str, messages: list) -> dict:
+    """Runs one interpreter with the loading mode and returns its numbers"""
+
+    env = dict(os.environ, PROTO_PY_LOADING=mode)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', PROBE] + messages,
+                                     cwd=ROOT_DIR, env=env)
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('messages', nargs='*',
+                        help='Messages to resolve after the start, as API rules do')
+    args = parser.parse_args()
+
+    run_probe('lazy', [])  # Makes the manifest if it is absent
+
+    results = {}
+    for mode in ('eager', 'lazy'):
+        runs = [run_probe(mode, args.messages) for _ in range(args.runs)]
+        results[mode] = {key: statistics.median(run[key] for run in runs)
+                         for key in runs[0]}
+
+    print(f'{"mode":<8}{"import, ms":>12}{"resolve, ms":>14}{"max RSS, KB":>14}')
+    for mode, result in results.items():
+        print(f'{mode:<8}{result["import_ms"]:>12.1f}'
+              f'{result["resolve_ms"]:>14.1f}{result["max_rss_kb"]:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Measures the cost of Rewriter.response per flow. The addon works
+headless in a mitmproxy test context on generated config,
+API rules and fake server files for the example protos (Item).
+Cases are all combinations of the given numbers of rules and API
+rules, body sizes, hit ratios and rule modes:
+    header  - rule changes status code and headers
+    save    - rule saves the content
+    rewrite - rule rewrites the content
+Flows which miss go to a path without rules. The example protos
+have to be installed to proto_py by setup.sh.
+
+Run it from the activated venv:
+    python3 benchmarks/response_hook.py --rules 10 1000 10000 --save-baseline baseline.json
+    python3 benchmarks/response_hook.py --rules 10 1000 10000 --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mitmproxy.test import taddons, tflow  # noqa: E402
+
+import helper  # noqa: E402
+import rewrite_core  # noqa: E402
+
+MODES = ('header', 'save', 'rewrite')
+HOST = 'bench.example.com'
+MISS_PATH = '/miss/path'
+
+
+def hit_path(rules: int) -> str:
+    """The last rule matches, so all others are checked before it"""
+    return f'/bench/{rules - 1}'
+
+
+def make_rule(index: int, mode: str) -> dict:
+    rule = {'authority_expr': HOST, 'path_expr': f'/bench/{index}', 'method': ['GET']}
+    if mode == 'header':
+        rule['status_code'] = 200
+        rule['headers'] = {'X-Bench': str(index)}
+    elif mode == 'save':
+        rule['save_content'] = 'bench/item.json'
+    else:
+        rule['rewrite_content'] = 'item.json'
+    return rule
+
+
+def write_data(directory: str, case: dict) -> dict:
+    """Writes files of the case and returns paths for the addon"""
+
+    paths = {name: os.path.join(directory, name)
+             for name in ('config.json', 'saves', 'fake_server', 'api_rules')}
+    for name in ('saves', 'fake_server', 'api_rules'):
+        os.makedirs(paths[name])
+
+    with open(paths['config.json'], 'w') as config_file:
+        json.dump([make_rule(index, case['mode']) for index in range(case['rules'])],
+                  config_file)
+
+    api_paths = [f'/bench/{index}' for index in range(case['api_rules'] - 1)]
+    api_paths.append(hit_path(case['rules']))
+    with open(os.path.join(paths['api_rules'], 'bench.json'), 'w') as api_file:
+        json.dump({'server': [HOST],
+                   'rules': [{'path': path, 'method': 'GET', 'proto_message': 'Item'}
+                             for path in api_paths]}, api_file)
+
+    with open(os.path.join(paths['fake_server'], 'item.json'), 'w') as fake_file:
+        json.dump({'id': 2, 'type': 'f' * case['body_size']}, fake_file)
+    return paths
+
+
+def make_flows(case: dict, count: int) -> list:
+    item_class = helper.registry.find('Item')
+    body = item_class(id=1, type='b' * case['body_size']).SerializeToString()
+    randomizer = random.Random(count)
+    flows = []
+    for _ in range(count):
+        flow = tflow.tflow(resp=True)
+        flow.request.host = HOST
+        flow.request.method = 'GET'
+        is_hit = randomizer.random() < case['hit_ratio']
+        flow.request.path = hit_path(case['rules']) if is_hit else MISS_PATH
+        flow.response.content = body
+        flows.append(flow)
+    return flows
+
+
+def percentile(sorted_values: list, part: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * part))]
+
+
+def run_case(case: dict, count: int) -> dict:
+    """Returns latency of the response hook in microseconds and flows per second"""
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_data(directory, case)
+        addon = rewrite_core.Rewriter(
+            paths['config.json'], paths['saves'], paths['fake_server'],
+            paths['api_rules'], paths['config.json'], paths['fake_server'],
+            paths['api_rules'], capture_overflow='block', headless=True)
+        try:
+            for flow in make_flows(case, 100):  # Warms up caches
+                addon.response(flow)
+            flows = make_flows(case, count)
+            latencies = []
+            for flow in flows:
+                start = time.perf_counter()
+                addon.response(flow)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            addon.done()
+
+    latencies.sort()
+    return {'p50_us': percentile(latencies, 0.5) * 1e6,
+            'p99_us': percentile(latencies, 0.99) * 1e6,
+            'flows_per_s': len(latencies) / sum(latencies)}
+
+
+def case_name(case: dict) -> str:
+    return ('{mode} rules={rules} api_rules={api_rules} '
+            'body={body_size} hit={hit_ratio}').format(**case)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns cases which are slower than the baseline more than tolerance"""
+
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['p50_us'] > base['p50_us'] * (1 + tolerance):
+            regressions.append(f'{name}: p50 {base["p50_us"]:.1f} -> {result["p50_us"]:.1f} us')
+        if result['p99_us'] > base['p99_us'] * (1 + tolerance):
+            regressions.append(f'{name}: p99 {base["p99_us"]:.1f} -> {result["p99_us"]:.1f} us')
+    return regressions
+
+
+async def run(args) -> dict:
+    results = {}
+    with taddons.context():
+        for rules, api_rules, body_size, hit_ratio, mode in itertools.product(
+                args.rules, args.api_rules, args.body_sizes, args.hit_ratios, args.modes):
+            case = {'mode': mode, 'rules': rules, 'api_rules': api_rules,
+                    'body_size': body_size, 'hit_ratio': hit_ratio}
+            result = results[case_name(case)] = run_case(case, args.flows)
+            print(f'{case_name(case):<60} p50 {result["p50_us"]:9.1f} us'
+                  f'  p99 {result["p99_us"]:9.1f} us'
+                  f'  {result["flows_per_s"]:10.0f} flows/s')
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flows', type=int, default=2000, help='Measured flows per case')
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--api-rules', type=int, nargs='+', default=[100])
+    parser.add_argument('--body-sizes', type=int, nargs='+', default=[1024])
+    parser.add_argument('--hit-ratios', type=float, nargs='+', default=[0.5])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--save-baseline', metavar='PATH', help='Write results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='Fail on regressions against a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown against the baseline, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('Regression:', regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
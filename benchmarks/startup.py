@@ -0,0 +1,77 @@
+"""
+Compares addon startup in headless and GUI modes. Each mode is
+measured in fresh interpreters: time of creating the Rewriter on the
+example config (until its window runs in GUI mode), max RSS and the
+number of threads after the start.
+GUI mode needs a display, its error is printed if there is none.
+
+Run it from the activated venv:
+    python3 benchmarks/startup.py --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, resource, sys, tempfile, threading, time
+from mitmproxy.test import taddons
+import rewrite_core  # Not a part of the measurement
+with taddons.context(), tempfile.TemporaryDirectory() as saves:
+    start = time.perf_counter()
+    addon = rewrite_core.Rewriter(
+        'data/config.json', saves, 'data/fake_server', 'data/api_rules',
+        'data/example_config.json', 'data/fake_server/example', 'data/api_rules/example',
+        headless=sys.argv[1] == 'headless')
+    if addon.gui is not None:  # Until the window runs
+        addon.gui.started.wait()
+        if addon.gui.window is None:
+            sys.exit('GUI cannot start, see the error above')
+    started = time.perf_counter()
+    threads = threading.active_count()
+    addon.done()
+print(json.dumps({
+    "start_ms": (started - start) * 1000,
+    "threads": threads,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+'''
+
+
+def run_probe(mode: str) -> dict:
+    """Runs one interpreter with the mode and returns its numbers"""
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+    process = subprocess.run([sys.executable, '-c', PROBE, mode], cwd=ROOT_DIR, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode:
+        raise RuntimeError(process.stderr.decode().strip().splitlines()[-1])
+    return json.loads(process.stdout.decode().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"mode":<10}{"start, ms":>12}{"threads":>10}{"max RSS, KB":>14}')
+    for mode in ('headless', 'gui'):
+        try:
+            runs = [run_probe(mode) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f'{mode:<10}failed: {e}')
+            continue
+        result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(f'{mode:<10}{result["start_ms"]:>12.1f}'
+              f'{result["threads"]:>10.0f}{result["max_rss_kb"]:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
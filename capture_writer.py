@@ -0,0 +1,267 @@
+"""
+Background writer for captured contents. The response hook only puts
+(path template, content) into a bounded queue, and a separate thread
+finds free names, creates directories and writes files in batches.
+Free names are given by in-memory counters, so saving costs the same
+no matter how many captures are already in the directory.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# What to do with a new capture when the queue is full
+OVERFLOW_POLICIES = ('drop', 'block', 'spill')
+# When to fsync written files
+FSYNC_POLICIES = ('never', 'batch', 'always')
+
+# Raw captures are saved as 'name<counter>.pb' with the message type in
+# 'name<counter>.pb.meta'. 'name<counter>.json' is kept free for conversion
+RAW_EXTENSION = '.pb'
+META_EXTENSION = '.pb.meta'
+JSON_EXTENSION = '.json'
+
+
+def raw_path(path_template: str) -> str:
+    """Returns template of raw captures for the template of json ones"""
+    return os.path.splitext(path_template)[0] + RAW_EXTENSION
+
+
+def meta_json(protobuf_msg_type, url: str, status_code: int) -> str:
+    """Returns content of the meta file of a raw capture"""
+
+    return json.dumps({'message': protobuf_msg_type.DESCRIPTOR.full_name,
+                       'module': protobuf_msg_type.__module__,
+                       'url': url,
+                       'status_code': status_code})
+
+
+def _open(path: str, content):
+    """Creates a new file for str or bytes content. Text is always
+    utf-8, json captures keep non-ASCII characters as they are"""
+
+    if isinstance(content, bytes):
+        return open(path, 'xb')
+    return open(path, 'x', encoding='utf-8')
+
+
+class FreeNames:
+    """Counters of free names for path templates. A template
+    'dir/name.ext' gives 'dir/name1.ext', 'dir/name2.ext' and so on.
+    Each directory is listed once, then all given names are remembered,
+    so templates sharing a directory never get the same name.
+    A name may have a group of other extensions sharing its counter,
+    all of them are free for the given name"""
+
+    def __init__(self):
+        self._counters = {}  # Last given counter for each template
+        self._taken = {}  # Names in each directory
+
+    def next(self, path_template: str, extensions=()) -> str:
+        """Returns a free path for the template. Names with
+        the other extensions of its group are taken too"""
+
+        directory, base_name = os.path.split(path_template)
+        taken = self._taken.get(directory)
+        if taken is None:
+            try:
+                taken = set(os.listdir(directory or '.'))
+            except FileNotFoundError:
+                taken = set()
+            self._taken[directory] = taken
+
+        file_name, file_extension = os.path.splitext(base_name)
+        counter = self._counters.get(path_template)
+        if counter is None:
+            counter = self._last_counter(file_name, file_extension, taken)
+        while True:
+            counter += 1
+            stem = file_name + str(counter)
+            name = stem + file_extension
+            group = [stem + extension for extension in extensions]
+            if name not in taken and taken.isdisjoint(group):
+                break
+        taken.add(name)
+        taken.update(group)
+        self._counters[path_template] = counter
+        return os.path.join(directory, name)
+
+    @staticmethod
+    def _last_counter(file_name: str, file_extension: str, taken: set) -> int:
+        """Returns the biggest counter of names saved by the template"""
+
+        last = 0
+        for name in taken:
+            if name.startswith(file_name) and name.endswith(file_extension):
+                counter = name[len(file_name):len(name) - len(file_extension)]
+                if counter.isdigit():
+                    last = max(last, int(counter))
+        return last
+
+
+class CaptureWriter(threading.Thread):
+    """Thread which writes captured contents to free file names.
+    Overflow policies: 'drop' loses the capture, 'block' waits for
+    a free place in the queue and 'spill' writes the capture in the
+    calling thread, as it was before this writer"""
+
+    def __init__(self, max_queue: int = 1024, overflow: str = 'drop',
+                 fsync: str = 'never', batch_size: int = 64,
+                 io_histogram=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow!r}')
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy {fsync!r}')
+        threading.Thread.__init__(self, name='capture-writer', daemon=True)
+        self.overflow = overflow
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.io_histogram = io_histogram  # Times of writing captures
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(max_queue)
+        self._errors = deque()
+        self._dirs = set()
+        self._names = FreeNames()
+        self._write_lock = threading.Lock()
+        self.start()
+
+    def save(self, path_template: str, content,
+             sidecars=(), extensions=()) -> bool:
+        """Queues str or bytes content to be saved by the template.
+        Sidecars are (extension, content) tuples saved with the same
+        name and counter, extensions are only kept free for it.
+        Returns False if the capture was dropped"""
+
+        item = (path_template, content, tuple(sidecars), tuple(extensions))
+        if self.overflow == 'block':
+            self._queue.put(item)
+            return True
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow == 'spill':
+                self._write_batch([item])
+                return True
+            self.dropped += 1
+            return False
+        return True
+
+    def pop_errors(self) -> list:
+        """Returns and forgets errors of writing.
+        They are logged by the addon from the proxy thread"""
+
+        errors = []
+        while self._errors:
+            errors.append(self._errors.popleft())
+        return errors
+
+    def flush(self) -> None:
+        """Waits until all queued captures are written"""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Writes all queued captures and stops the thread"""
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        """This runs as a thread"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not None]
+            try:
+                if items:
+                    self._write_batch(items)
+            except Exception as e:  # The thread must live, or saves hang
+                self._errors.append(f'Cannot save captures: {e!r}')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(items) < len(batch):  # Got the stop item from close()
+                return
+
+    def _write_batch(self, items: list) -> None:
+        with self._write_lock:
+            opened = []
+            try:
+                for path_template, content, sidecars, extensions in items:
+                    start = time.perf_counter()
+                    try:
+                        self._write_item(path_template, content, sidecars,
+                                         extensions, opened)
+                    except Exception as e:  # One bad capture does not stop others
+                        self._errors.append(f'Cannot save capture to {path_template}: {e!r}')
+                    if self.io_histogram is not None:
+                        self.io_histogram.observe(time.perf_counter() - start)
+            finally:
+                for save_file in opened:
+                    self._close(save_file)
+
+    def _write_item(self, path_template: str, content, sidecars: tuple,
+                    extensions: tuple, opened: list) -> None:
+        extensions += tuple(extension for extension, _ in sidecars)
+        try:
+            save_file = self._create(path_template, content, extensions)
+        except OSError as e:
+            self._errors.append(f'Cannot save capture to {path_template}: {e}')
+            return
+        opened.append(save_file)
+        try:
+            save_file.write(content)
+            self.written += 1
+        except OSError as e:
+            self._errors.append(f'Cannot save capture to {save_file.name}: {e}')
+        if self.fsync != 'batch':
+            self._close(opened.pop())
+        self._write_sidecars(save_file.name, sidecars)
+
+    def _write_sidecars(self, path: str, sidecars: tuple) -> None:
+        stem = os.path.splitext(path)[0]
+        for extension, content in sidecars:
+            try:
+                sidecar_file = _open(stem + extension, content)
+            except OSError as e:
+                self._errors.append(f'Cannot save {extension} file of {path}: {e}')
+                continue
+            try:
+                sidecar_file.write(content)
+            except OSError as e:
+                self._errors.append(f'Cannot save {sidecar_file.name}: {e}')
+            self._close(sidecar_file)
+
+    def _create(self, path_template: str, content, extensions=()):
+        """Opens a new file with a free name for the template"""
+
+        directory = os.path.dirname(path_template)
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+        while True:
+            try:
+                return _open(self._names.next(path_template, extensions), content)
+            except FileExistsError:
+                continue  # Created by someone else after the directory listing
+
+    def _close(self, save_file) -> None:
+        try:
+            if self.fsync != 'never':
+                save_file.flush()
+                os.fsync(save_file.fileno())
+        except OSError as e:
+            self._errors.append(f'Cannot sync capture {save_file.name}: {e}')
+        except Exception as e:
+            self._errors.append(f'Cannot save capture {save_file.name}: {e!r}')
+        finally:
+            try:
+                save_file.close()
+            except Exception as e:  # Buffered text is written by close too
+                self._errors.append(f'Cannot save capture {save_file.name}: {e!r}')
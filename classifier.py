@@ -0,0 +1,190 @@
+"""
+Guessing of protobuf message type by the wire format of a body.
+Each message type gets a signature of its field numbers and wire
+types once. A body is scanned only by its top level tags, without
+decoding, and the types which accept all of its tags are ranked by
+how many of their fields the body has.
+"""
+
+from typing import NamedTuple
+
+from google.protobuf.descriptor import FieldDescriptor
+
+import message_builder
+
+VARINT, FIXED64, LENGTH_DELIMITED, START_GROUP, END_GROUP, FIXED32 = range(6)
+
+_WIRE_TYPES = {
+    FieldDescriptor.TYPE_DOUBLE: FIXED64,
+    FieldDescriptor.TYPE_FIXED64: FIXED64,
+    FieldDescriptor.TYPE_SFIXED64: FIXED64,
+    FieldDescriptor.TYPE_FLOAT: FIXED32,
+    FieldDescriptor.TYPE_FIXED32: FIXED32,
+    FieldDescriptor.TYPE_SFIXED32: FIXED32,
+    FieldDescriptor.TYPE_STRING: LENGTH_DELIMITED,
+    FieldDescriptor.TYPE_BYTES: LENGTH_DELIMITED,
+    FieldDescriptor.TYPE_MESSAGE: LENGTH_DELIMITED,
+    FieldDescriptor.TYPE_GROUP: START_GROUP,
+}  # Other types are varints
+
+# Bodies are classified by the tags of their beginning
+MAX_TAGS = 1024
+
+
+def wire_type(field) -> int:
+    """Returns wire type of the field, packed one is not considered"""
+    return _WIRE_TYPES.get(field.type, VARINT)
+
+
+def _read_varint(buffer, position: int) -> tuple:
+    """Returns (value, next position). Raises ValueError if it is broken"""
+
+    result = 0
+    shift = 0
+    while shift < 64:
+        if position >= len(buffer):
+            raise ValueError('Truncated varint')
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+    raise ValueError('Varint is too long')
+
+
+def scan_tags(content: bytes, max_tags: int = MAX_TAGS) -> frozenset:
+    """Returns distinct top level (field number, wire type) tags
+    of the body or None if it is not a protobuf message"""
+
+    tags = set()
+    position = 0
+    size = len(content)
+    depth = 0  # Nesting of groups which are skipped
+    try:
+        while position < size and max_tags > 0:
+            key, position = _read_varint(content, position)
+            number, wire_type = key >> 3, key & 7
+            if number == 0:
+                return None
+            top_level = depth == 0
+            if wire_type == VARINT:
+                _, position = _read_varint(content, position)
+            elif wire_type == FIXED64:
+                position += 8
+            elif wire_type == LENGTH_DELIMITED:
+                length, position = _read_varint(content, position)
+                position += length
+            elif wire_type == FIXED32:
+                position += 4
+            elif wire_type == START_GROUP:
+                depth += 1
+            elif wire_type == END_GROUP and depth > 0:
+                depth -= 1
+                continue
+            else:
+                return None
+            if position > size:
+                return None
+            if top_level:
+                tags.add((number, wire_type))
+                max_tags -= 1
+    except ValueError:
+        return None
+    if depth and max_tags > 0:  # Body ends inside a group
+        return None
+    return frozenset(tags)
+
+
+class Signature(NamedTuple):
+    """Wire format of one message type"""
+    tags: frozenset  # Accepted (field number, wire type) tags
+    required: frozenset  # Numbers of required fields
+    size: int  # Number of fields
+
+    @classmethod
+    def of(cls, protobuf_msg_type):
+        tags = set()
+        required = set()
+        fields = protobuf_msg_type.DESCRIPTOR.fields
+        for field in fields:
+            field_wire_type = wire_type(field)
+            tags.add((field.number, field_wire_type))
+            if message_builder.is_repeated(field) and\
+                    field_wire_type != LENGTH_DELIMITED and field_wire_type != START_GROUP:
+                tags.add((field.number, LENGTH_DELIMITED))  # Packed scalars
+            if message_builder.is_required(field):
+                required.add(field.number)
+        return cls(frozenset(tags), frozenset(required), len(fields))
+
+
+class Classifier:
+    """Ranks message types for bodies. Search among all types works
+    after load() has built their signatures, load_classes returns
+    these types"""
+
+    def __init__(self, load_classes):
+        self._load_classes = load_classes
+        self._signatures = {}  # {class: Signature}
+        self._accepting = None  # {tag: set of classes with it}, made by load()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._accepting is not None
+
+    def signature(self, protobuf_msg_type) -> Signature:
+        signature = self._signatures.get(protobuf_msg_type)
+        if signature is None:
+            signature = self._signatures[protobuf_msg_type] = \
+                Signature.of(protobuf_msg_type)
+        return signature
+
+    def load(self) -> None:
+        """Builds signatures of all message types. It imports all lazy
+        modules, so the addon calls it in a worker thread. The index
+        is replaced at once, searches don't see it half built"""
+
+        accepting = {}
+        for protobuf_msg_type in self._load_classes():
+            for tag in Signature.of(protobuf_msg_type).tags:
+                accepting.setdefault(tag, set()).add(protobuf_msg_type)
+        self._accepting = accepting
+
+    def rank(self, content: bytes, candidates=None, limit: int = 3) -> list:
+        """Returns up to limit message types which can be the type
+        of the body, the most likely first. Candidates limit the search
+        and keep their order for equally likely types. Without them
+        nothing is found until load() is done"""
+
+        tags = scan_tags(content)
+        if not tags:  # Empty body fits any type
+            return []
+
+        if candidates is None:
+            if self._accepting is None:
+                return []
+            found = None
+            for tag in tags:
+                found = self._accepting.get(tag, set()) if found is None\
+                    else found & self._accepting.get(tag, set())
+                if not found:
+                    return []
+            candidates = sorted(found, key=lambda c: c.DESCRIPTOR.full_name)
+        else:
+            candidates = [c for c in candidates if tags <= self.signature(c).tags]
+
+        numbers = {number for number, _ in tags}
+        scored = []
+        for order, protobuf_msg_type in enumerate(candidates):
+            signature = self.signature(protobuf_msg_type)
+            if signature.required <= numbers:  # Otherwise it fails to decode
+                scored.append((-len(numbers) / signature.size, order,
+                               protobuf_msg_type))
+        scored.sort(key=lambda score: score[:2])
+        return [protobuf_msg_type for _, _, protobuf_msg_type in scored[:limit]]
+
+    def classify(self, content: bytes, candidates=None):
+        """Returns the most likely message type of the body or None"""
+
+        ranked = self.rank(content, candidates, limit=1)
+        return ranked[0] if ranked else None
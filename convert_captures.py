@@ -0,0 +1,79 @@
+"""
+Converts raw captures ("save_format": "raw") to json files.
+Each 'name<counter>.pb' with its 'name<counter>.pb.meta' is decoded
+by the message type from the meta file to 'name<counter>.json'.
+Files are converted in parallel by worker processes.
+
+Run it from the activated venv:
+    python3 convert_captures.py data/saves --workers 4 --delete
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import capture_writer
+import offload
+
+
+def find_captures(directory: str) -> list:
+    """Returns paths of all raw captures in the directory tree"""
+
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files
+                     if name.endswith(capture_writer.RAW_EXTENSION))
+    return sorted(paths)
+
+
+def convert(path: str, overwrite: bool = False, delete: bool = False) -> str:
+    """Converts one raw capture. Returns error or None"""
+
+    stem = path[:-len(capture_writer.RAW_EXTENSION)]
+    meta_path = stem + capture_writer.META_EXTENSION
+    try:
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        protobuf_msg_type = offload.helper.registry.find_by_full_name(meta['message'])
+        if protobuf_msg_type is None:
+            return f'{path}: unknown message {meta["message"]}'
+        with open(path, 'rb') as raw_file:
+            json_content = offload.helper.message_to_json(protobuf_msg_type, raw_file.read())
+        with open(stem + capture_writer.JSON_EXTENSION,
+                  'w' if overwrite else 'x', encoding='utf-8') as json_file:
+            json_file.write(json_content)
+        if delete:
+            os.unlink(path)
+            os.unlink(meta_path)
+    except Exception as e:
+        return f'{path}: {e}'
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='Directory with raw captures')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Replace json files which already exist')
+    parser.add_argument('--delete', action='store_true',
+                        help='Remove raw captures after the conversion')
+    args = parser.parse_args()
+
+    paths = find_captures(args.directory)
+    failed = 0
+    with multiprocessing.Pool(args.workers, initializer=offload.init_worker) as pool:
+        jobs = [(path, args.overwrite, args.delete) for path in paths]
+        for error in pool.starmap(convert, jobs, chunksize=16):
+            if error is not None:
+                failed += 1
+                print(error, file=sys.stderr)
+    print(f'Converted {len(paths) - failed} of {len(paths)} captures')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
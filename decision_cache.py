@@ -0,0 +1,58 @@
+"""
+Cache of matching results for endpoints. Flows to the same
+(host, path, method) get the same config rule and API rule, so
+they are found once and kept in a bounded LRU cache, including
+results where nothing matched. The cache belongs to one snapshot
+version and is cleared when a newer version comes.
+"""
+
+from collections import OrderedDict
+
+UNRESOLVED = object()  # API rule which has not been searched yet
+
+
+class DecisionCache:
+    """LRU cache of [rule, API entry] decisions of one snapshot version"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._decisions = OrderedDict()
+
+    def __len__(self):
+        return len(self._decisions)
+
+    def get(self, version: int, key: tuple) -> list:
+        """Returns the decision for the key or None"""
+
+        if version != self.version:
+            if version < self.version:  # Flow of an old version
+                self.misses += 1
+                return None
+            self.version = version
+            self._decisions.clear()
+
+        decision = self._decisions.get(key)
+        if decision is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._decisions.move_to_end(key)
+        return decision
+
+    def put(self, version: int, key: tuple, decision: list) -> None:
+        """Keeps the decision if it is made for the current version"""
+
+        if version != self.version:
+            return
+        self._decisions[key] = decision
+        if len(self._decisions) > self.max_size:
+            self._decisions.popitem(last=False)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {'size': len(self._decisions), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0}
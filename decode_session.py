@@ -0,0 +1,238 @@
+"""
+Decodes protobuf responses of a recorded session (run_mitm.sh writes
+it to 'last_session') to json. Flows are read from the dump one by one
+and matched with API rules as the addon does, then their bodies are
+decoded by worker processes in batches. Only a few batches are in
+flight at once, so memory does not grow with the size of the dump.
+Records keep the order of flows, one per line (ndjson) or in one
+json array. Error bodies are decoded as the error type they look like.
+
+Run it from the activated venv:
+    python3 decode_session.py last_session -o session.ndjson --workers 4
+    python3 decode_session.py last_session --format json -o session.json
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import sys
+from urllib.parse import urlparse
+
+from mitmproxy import http
+from mitmproxy import io as mitmproxy_io
+from mitmproxy.net import encoding
+
+import classifier
+import helper
+import matching
+import offload
+import watcher
+
+TEXT = ('text',)  # Message types of text API rules
+
+# Paths from rewrite.py
+CONFIG_FILE_PATH = 'data/config.json'
+API_RULES_DIR = 'data/api_rules'
+EXAMPLE_API_RULES_DIR = 'data/api_rules/example'
+
+# Error bodies are classified among the error types of their rule only
+_classifier = classifier.Classifier(helper.registry.classes)
+
+
+def _decode(number: int, url: str, method: str, status_code: int,
+            full_names: tuple, content_encoding: str, raw_content: bytes,
+            indent: int) -> tuple:
+    """Returns (json record, None) or (None, error)"""
+
+    record = {'flow': number, 'url': url, 'method': method,
+              'status_code': status_code}
+    try:
+        content = raw_content
+        if content_encoding:
+            content = encoding.decode(raw_content, content_encoding)
+        if full_names == TEXT:
+            record['message'] = 'text'
+            record['body'] = content.decode('utf-8', 'replace')
+        else:
+            msg_types = [helper.registry.find_by_full_name(full_name)
+                         for full_name in full_names]
+            msg_type = msg_types[0]
+            if len(msg_types) > 1:
+                msg_type = _classifier.classify(content, msg_types) or msg_type
+            record['message'] = msg_type.DESCRIPTOR.full_name
+            record['body'] = helper.message_to_dict(msg_type, content)
+    except Exception as e:
+        return None, f'Flow #{number} {url}: {e}'
+    return json.dumps(record, indent=indent, ensure_ascii=False), None
+
+
+def _decode_batch(jobs: list, indent: int) -> list:
+    return [_decode(*job, indent) for job in jobs]
+
+
+def load_api_map(api_rules_dir: str) -> list:
+    """Reads API files by the loader of the addon, in the same order.
+    Errors go to stderr"""
+
+    api_watcher = watcher.ConfigWatcher(None, api_rules_dir)
+    api_watcher.poll_api_map()
+    for error in api_watcher.errors:
+        print(error, file=sys.stderr)
+    return api_watcher.api_map
+
+
+def default_api_rules_dir() -> str:
+    """Returns API rules directory which the addon uses: the example
+    one if there is no config, as Rewriter does"""
+
+    if os.path.isfile(CONFIG_FILE_PATH):
+        return API_RULES_DIR
+    return EXAMPLE_API_RULES_DIR
+
+
+def message_full_names(api_entry: matching.ApiEntry, status_code: int) -> tuple:
+    """Returns full names of message types for the body, as
+    Rewriter.message_types does, or None if the rule has no message"""
+
+    if api_entry.message_class == 'text':
+        return TEXT
+    if api_entry.message_class is None:
+        return None
+    if 200 <= status_code < 300 or not api_entry.error_classes:
+        return (api_entry.message_class.DESCRIPTOR.full_name,)
+    return tuple(error_class.DESCRIPTOR.full_name
+                 for error_class in api_entry.error_classes)
+
+
+class Stats:
+    """Counts of flows by their result"""
+
+    def __init__(self):
+        self.read = 0
+        self.unmapped = 0
+        self.decoded = 0
+        self.failed = 0
+
+
+def read_jobs(dump_file, api_index: matching.ApiIndex, stats: Stats):
+    """Yields decoding jobs of HTTP responses which have API rules"""
+
+    for flow in mitmproxy_io.FlowReader(dump_file).stream():
+        if not isinstance(flow, http.HTTPFlow) or flow.response is None or\
+                flow.response.raw_content is None:
+            continue
+        stats.read += 1
+        number = stats.read
+
+        # Matches the request as Rewriter.match_api does
+        url = urlparse(flow.request.pretty_url)
+        api_entry = api_index.match(url.netloc.split(':', 1)[0], url.path,
+                                    flow.request.method)
+        full_names = None
+        if api_entry is not None:
+            full_names = message_full_names(api_entry, flow.response.status_code)
+        if full_names is None:
+            stats.unmapped += 1
+            continue
+
+        yield (number, flow.request.pretty_url, flow.request.method,
+               flow.response.status_code, full_names,
+               flow.response.headers.get('content-encoding', ''),
+               flow.response.raw_content)
+
+
+def batches(jobs, size: int):
+    batch = []
+    for job in jobs:
+        batch.append(job)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class RecordWriter:
+    """Writes records one per line or as items of one json array"""
+
+    def __init__(self, output, is_array: bool):
+        self.output = output
+        self.is_array = is_array
+        self.count = 0
+
+    def write(self, record: str) -> None:
+        if self.is_array:
+            self.output.write(',\n' if self.count else '[\n')
+            self.output.write(record)
+        else:
+            self.output.write(record + '\n')
+        self.count += 1
+
+    def close(self) -> None:
+        if self.is_array:
+            self.output.write('\n]\n' if self.count else '[]\n')
+        self.output.flush()
+
+
+def write_results(results: list, writer: RecordWriter, stats: Stats) -> None:
+    for record, error in results:
+        if error is None:
+            stats.decoded += 1
+            writer.write(record)
+        else:
+            stats.failed += 1
+            print(error, file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dump', nargs='?', default='last_session',
+                        help='Flows file written by mitmproxy -w')
+    parser.add_argument('-o', '--output', default='-', help='Output file, - is stdout')
+    parser.add_argument('--format', choices=('ndjson', 'json'), default='ndjson')
+    parser.add_argument('--api-rules', default=None,
+                        help='Directory with API rules files, by default the one '
+                             'the addon uses')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch', type=int, default=64, help='Flows in one worker task')
+    parser.add_argument('--in-flight', type=int, default=0,
+                        help='Max batches in workers at once, default is 2 per worker')
+    args = parser.parse_args()
+
+    api_index = matching.ApiIndex(load_api_map(args.api_rules or default_api_rules_dir()),
+                                  helper.find_protobuf_message_class)
+    for error in api_index.errors:
+        print(error, file=sys.stderr)
+
+    max_in_flight = args.in_flight or 2 * args.workers
+    indent = 2 if args.format == 'json' else None
+    stats = Stats()
+    output = sys.stdout if args.output == '-' else \
+        open(args.output, 'w', encoding='utf-8')
+    writer = RecordWriter(output, args.format == 'json')
+    try:
+        with open(args.dump, 'rb') as dump_file, \
+                multiprocessing.Pool(args.workers, initializer=offload.init_worker) as pool:
+            in_flight = collections.deque()
+            for batch in batches(read_jobs(dump_file, api_index, stats), args.batch):
+                if len(in_flight) >= max_in_flight:
+                    write_results(in_flight.popleft().get(), writer, stats)
+                in_flight.append(pool.apply_async(_decode_batch, (batch, indent)))
+            while in_flight:
+                write_results(in_flight.popleft().get(), writer, stats)
+        writer.close()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f'Read {stats.read} responses: {stats.decoded} decoded, '
+          f'{stats.failed} failed, {stats.unmapped} without API rules',
+          file=sys.stderr)
+    sys.exit(1 if stats.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 from importlib import import_module
-from os.path import dirname, normpath, sep, basename, relpath, split, join
-from os import walk
+from os.path import dirname, normpath, sep, basename, relpath, split, join, getmtime
+from os import walk, environ
 import inspect
+import json
 import sys
 
 root_path = dirname(__file__)
@@ -12,16 +13,86 @@ for subdir in subdirs:
     if ((module_path not in sys.path) & (subdir != '__pycache__')):
         sys.path.append(module_path)
 
-# r=root, d=directories, f = files
+# 'eager' imports all modules right now, 'lazy' imports them on demand
+# by the manifest which maps message names to modules
+LOADING = environ.get('PROTO_PY_LOADING', 'eager')
+MANIFEST_PATH = join(root_path, 'manifest.json')
+
+
+def module_files() -> dict:
+    """Returns {import name: file path} of all generated modules"""
+    files = {}
+    # r=root, d=directories, f = files
+    for r, d, f in walk(dirname(__file__)):
+        if '__pycache__' in d:
+            d.remove('__pycache__')
+        if ((r == dirname(__file__)) & (len(d) > 1) & ('example' in d)):
+            d.remove('example')
+        import_path = normpath(relpath(r, split(dirname(__file__))[0])).replace(sep, '.')
+        for _file in f:
+            if _file.endswith('.py') and not _file.endswith('__init__.py'):
+                files[import_path + '.' + basename(_file)[:-3]] = join(r, _file)
+    return files
+
+
+def scan(files: dict) -> list:
+    """Imports all modules and returns all classes from them"""
+    classes = []
+    for import_name in files:
+        module = import_module(import_name)
+        for class_with_name in inspect.getmembers(module, inspect.isclass):
+            classes.append(class_with_name[1])
+    return classes
+
+
+def write_manifest(files: dict = None) -> list:
+    """Writes manifest of messages found in the modules and returns
+    its entries: [import name, class name, class module, full name]"""
+    if files is None:
+        files = module_files()
+    entries = []
+    for import_name in files:
+        module = import_module(import_name)
+        for name, cls in inspect.getmembers(module, inspect.isclass):
+            descriptor = getattr(cls, 'DESCRIPTOR', None)
+            if hasattr(descriptor, 'full_name'):
+                entries.append([import_name, name, cls.__module__, descriptor.full_name])
+    manifest = {'modules': {name: getmtime(path) for name, path in files.items()},
+                'messages': entries}
+    try:
+        with open(MANIFEST_PATH, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+    except OSError:
+        pass  # Read only installation. Manifest will be made on every start
+    return entries
+
+
+def read_manifest(files: dict) -> list:
+    """Returns entries of the manifest or None if it is absent or stale"""
+    try:
+        with open(MANIFEST_PATH) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    modules = {name: getmtime(path) for name, path in files.items()}
+    if not isinstance(manifest, dict) or manifest.get('modules') != modules or\
+            not isinstance(manifest.get('messages'), list):
+        return None
+    return manifest['messages']
+
+
+def load_class(entry):
+    """Imports module of the manifest entry and returns its class"""
+    return getattr(import_module(entry[0]), entry[1])
+
+
 clsmembers = []
-for r, d, f in walk(dirname(__file__)):
-    if '__pycache__' in d:
-        d.remove('__pycache__')
-    if ((r == dirname(__file__)) & (len(d) > 1) & ('example' in d)):
-        d.remove('example')
-    import_path = normpath(relpath(r, split(dirname(__file__))[0])).replace(sep, '.')
-    for _file in f:
-        if _file.endswith('.py') and not _file.endswith('__init__.py'):
-            module = import_module('.' + basename(_file)[:-3], import_path)
-            for class_with_name in inspect.getmembers(module, inspect.isclass):
-                clsmembers.append(class_with_name[1])
+manifest = None
+if LOADING == 'lazy':
+    _files = module_files()
+    manifest = read_manifest(_files)
+    if manifest is None:  # First scan. It imports everything once
+        clsmembers = scan(_files)
+        manifest = write_manifest(_files)
+else:
+    clsmembers = scan(module_files())
@@ -0,0 +1,257 @@
+"""
+Compiled structures for matching requests against the addon rules.
+They are built once per config version and then only read
+from the response hook, so matching cost depends on the number
+of candidate rules, not on the total number of rules.
+"""
+
+import re
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+# Methods which a config rule matches if it has no 'method' field
+DEFAULT_METHODS = ["GET", "POST", "PUT", "DELETE"]
+
+_META_CHARS = frozenset('.^$*+?{}[]\\|()')
+_QUANTIFIERS = frozenset('*+?{')
+
+
+def literal_prefix(pattern: str) -> str:
+    """Returns the literal text that every string matched
+    by re.match(pattern, string) has to start with"""
+
+    if '|' in pattern:  # Alternation may drop any prefix
+        return ''
+    prefix = []
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if not escaped or escaped.isalnum():  # Classes like \d or \w
+                break
+            literal, step = escaped, 2
+        elif char in _META_CHARS:
+            break
+        else:
+            literal, step = char, 1
+        if pattern[i + step:i + step + 1] in _QUANTIFIERS:
+            break  # The last char is optional or repeated
+        prefix.append(literal)
+        i += step
+    return ''.join(prefix)
+
+
+class PrefixIndex:
+    """Buckets of values keyed by literal prefixes. Looking up a string
+    returns buckets of all prefixes it starts with, so its cost depends
+    on the number of distinct prefix lengths only"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lengths = []
+
+    def setdefault(self, prefix: str, factory):
+        """Returns the bucket for the prefix, creating it by factory()"""
+        bucket = self._buckets.get(prefix)
+        if bucket is None:
+            bucket = self._buckets[prefix] = factory()
+            if len(prefix) not in self._lengths:
+                self._lengths.append(len(prefix))
+                self._lengths.sort()
+        return bucket
+
+    def values(self):
+        """Returns all buckets"""
+        return self._buckets.values()
+
+    def find(self, string: str) -> list:
+        """Returns buckets for all prefixes of the string"""
+        buckets = self._buckets
+        found = []
+        for length in self._lengths:
+            if length > len(string):
+                break
+            bucket = buckets.get(string[:length])
+            if bucket is not None:
+                found.append(bucket)
+        return found
+
+
+def compile_path(path_expr: str):
+    """Compiles the path expression in the same way as rules
+    always did: with any count of leading slashes and full match"""
+
+    return re.compile('^/*' + path_expr + '$').match
+
+
+def path_key(path_expr: str) -> str:
+    """Returns literal prefix of the path expression
+    to be compared with the url path without leading slashes"""
+
+    return literal_prefix(path_expr).lstrip('/')
+
+
+class RuleMatcher:
+    """Compiled list of config rules. Rules are bucketed by method,
+    by literal prefix of authority and by literal prefix of path.
+    Regular expressions run only for candidates from these buckets,
+    and the first rule from the config wins as before"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.errors = []
+        self._by_method = {}
+
+        for order, rule in enumerate(rules):
+            if not rule.get('is_on', True):
+                continue
+            authority_expr = rule.get('authority_expr', '.*')
+            path_expr = rule.get('path_expr', '.*')
+            try:
+                entry = (order, re.compile(authority_expr).match,
+                         compile_path(path_expr), rule)
+            except re.error as e:
+                self.errors.append(f'Rule #{order} in config has invalid expression: {e}')
+                continue
+
+            methods = rule.get('method', DEFAULT_METHODS)
+            if isinstance(methods, str):
+                methods = [methods]
+            for method in set(methods):
+                authorities = self._by_method.setdefault(method, PrefixIndex())
+                paths = authorities.setdefault(literal_prefix(authority_expr),
+                                               PrefixIndex)
+                paths.setdefault(path_key(path_expr), list).append(entry)
+
+    def match(self, authority: str, path: str, method: str) -> dict:
+        """Returns the first rule that matches the request or None"""
+
+        authorities = self._by_method.get(method)
+        if authorities is None:
+            return None
+
+        stripped_path = path.lstrip('/')
+        candidates = []
+        for paths in authorities.find(authority):
+            for entries in paths.find(stripped_path):
+                candidates.extend(entries)
+        if len(candidates) > 1:
+            candidates.sort(key=_order)
+
+        for _, authority_match, path_match, rule in candidates:
+            if authority_match(authority) and path_match(path):
+                return rule
+        return None
+
+
+class ApiEntry(NamedTuple):
+    """Read-only API rule resolved with its protobuf message classes"""
+    rule: Mapping
+    file_name: str
+    message_class: object  # Protobuf message class, 'text' or None
+    error_classes: tuple
+
+
+class CompiledApi:
+    """Servers and path and method tables of one API file"""
+
+    def __init__(self, api: dict, file_name: str, resolve):
+        self.api = api
+        self.file_name = file_name
+        self.errors = []
+        self.servers = []  # [(literal prefix, compiled server)]
+        self._by_method = PrefixIndex()
+
+        for server in api.get('server') or []:
+            try:
+                self.servers.append((literal_prefix(server), re.compile(server).match))
+            except re.error as e:
+                self.errors.append(f'Server {server!r} in {file_name} is invalid: {e}')
+
+        error_classes = []
+        for error in api.get('errors') or []:
+            error_class = resolve(error)
+            if error_class is not None:
+                error_classes.append(error_class)
+        error_classes = tuple(error_classes)
+
+        for order, rule in enumerate(api.get('rules') or []):
+            method_expr = rule.get('method', '.*')
+            path_expr = rule.get('path', '.*')
+            try:
+                method_match = re.compile(method_expr).match
+                path_match = compile_path(path_expr)
+            except re.error as e:
+                self.errors.append(f'Rule #{order} in {file_name} has invalid expression: {e}')
+                continue
+            entry = ApiEntry(MappingProxyType(rule), file_name,
+                             resolve(rule), error_classes)
+            paths = self._by_method.setdefault(literal_prefix(method_expr),
+                                               PrefixIndex)
+            paths.setdefault(path_key(path_expr), list).append(
+                (order, method_match, path_match, entry))
+
+    def match(self, path: str, method: str) -> ApiEntry:
+        """Returns the first API rule that matches the request or None"""
+
+        stripped_path = path.lstrip('/')
+        candidates = []
+        for paths in self._by_method.find(method):
+            for entries in paths.find(stripped_path):
+                candidates.extend(entries)
+        if len(candidates) > 1:
+            candidates.sort(key=_order)
+
+        for _, method_match, path_match, entry in candidates:
+            if path_match(path) and method_match(method):
+                return entry
+        return None
+
+
+class ApiIndex:
+    """Compiled API map. Servers are bucketed by literal prefix and
+    checked in the order of API files, then the path and method tables
+    of the matched API are used. The index is never changed after
+    building, a new one is built for a new API map. Files which are the
+    same objects as in the previous index are not compiled again"""
+
+    def __init__(self, api_map, resolve, previous: 'ApiIndex' = None):
+        self.api_map = api_map
+        self.errors = []  # Errors of newly compiled files only
+        self._apis = []
+        self._servers = PrefixIndex()
+
+        compiled_apis = {}
+        if previous is not None:
+            compiled_apis = {(id(compiled.api), compiled.file_name): compiled
+                             for compiled in previous._apis}
+
+        for api, file_name in api_map:
+            compiled = compiled_apis.get((id(api), file_name))
+            if compiled is None or compiled.api is not api:
+                compiled = CompiledApi(api, file_name, resolve)
+                self.errors.extend(compiled.errors)
+            order = len(self._apis)
+            self._apis.append(compiled)
+            for prefix, server_match in compiled.servers:
+                self._servers.setdefault(prefix, list).append((order, server_match))
+
+    def match(self, authority: str, path: str, method: str) -> ApiEntry:
+        """Returns the API rule for the request or None"""
+
+        orders = set()
+        for servers in self._servers.find(authority):
+            for order, server_match in servers:
+                if order not in orders and server_match(authority):
+                    orders.add(order)
+
+        for order in sorted(orders):
+            entry = self._apis[order].match(path, method)
+            if entry is not None:
+                return entry
+        return None
+
+
+def _order(entry) -> int:
+    return entry[0]
@@ -0,0 +1,363 @@
+"""
+Building of protobuf messages from loaded json. A plan of each message
+descriptor is compiled once: json keys (field names, json names and
+camelCase forms of snake_case names) are mapped to fields with
+converters of values. Then the message is filled straight from the dict in one
+pass, without a json string and json_format.Parse. Well-known types
+with special json forms (Timestamp, Struct, Any..) are left to
+json_format.ParseDict.
+"""
+
+import base64
+import math
+
+from google.protobuf import json_format
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import EncodeError
+
+
+class BuildError(ValueError):
+    """Json does not fit the message. Path is the path of the wrong
+    field like 'items[2].name'. It is built while the error goes up"""
+
+    def __init__(self, reason: str, segments=None):
+        ValueError.__init__(self, reason)
+        self.reason = reason
+        self.segments = segments or []
+
+    def prepend(self, segment) -> None:
+        self.segments.insert(0, segment)
+
+    @property
+    def path(self) -> str:
+        path = ''
+        for segment in self.segments:
+            if isinstance(segment, int):
+                path += f'[{segment}]'
+            else:
+                path += f'.{segment}' if path else str(segment)
+        return path
+
+    def __str__(self):
+        return f'{self.path or "<root>"}: {self.reason}'
+
+
+def is_repeated(field) -> bool:
+    """Protobuf 7 has no FieldDescriptor.label, old versions have
+    no is_repeated"""
+    try:
+        return field.is_repeated
+    except AttributeError:
+        return field.label == FieldDescriptor.LABEL_REPEATED
+
+
+def is_required(field) -> bool:
+    try:
+        return field.is_required
+    except AttributeError:
+        return field.label == FieldDescriptor.LABEL_REQUIRED
+
+
+def _camel_case(snake_str: str) -> str:
+    components = snake_str.split('_')
+    return components[0] + ''.join(x.title() for x in components[1:])
+
+
+_INT_RANGES = {
+    FieldDescriptor.CPPTYPE_INT32: (-2 ** 31, 2 ** 31 - 1),
+    FieldDescriptor.CPPTYPE_INT64: (-2 ** 63, 2 ** 63 - 1),
+    FieldDescriptor.CPPTYPE_UINT32: (0, 2 ** 32 - 1),
+    FieldDescriptor.CPPTYPE_UINT64: (0, 2 ** 64 - 1),
+}
+_SPECIAL_FLOATS = {'NaN': math.nan, 'Infinity': math.inf, '-Infinity': -math.inf}
+
+
+def _to_int(field, value):
+    if isinstance(value, bool):
+        raise BuildError(f'expected integer, got {value!r}')
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise BuildError(f'expected integer, got {value!r}')
+        value = int(value)
+    elif isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            raise BuildError(f'expected integer, got {value!r}') from None
+    elif not isinstance(value, int):
+        raise BuildError(f'expected integer, got {type(value).__name__}')
+    low, high = _INT_RANGES[field.cpp_type]
+    if not low <= value <= high:
+        raise BuildError(f'value {value} is out of range')
+    return value
+
+
+def _to_float(field, value):
+    if isinstance(value, str) and value in _SPECIAL_FLOATS:
+        return _SPECIAL_FLOATS[value]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise BuildError(f'expected number, got {value!r}')
+    return float(value)
+
+
+def _to_bool(field, value):
+    if not isinstance(value, bool):
+        raise BuildError(f'expected bool, got {value!r}')
+    return value
+
+
+def _to_string(field, value):
+    if not isinstance(value, str):
+        raise BuildError(f'expected string, got {type(value).__name__}')
+    return value
+
+
+def _to_bytes(field, value):
+    if not isinstance(value, str):
+        raise BuildError(f'expected base64 string, got {type(value).__name__}')
+    padded = value + '=' * (-len(value) % 4)
+    try:
+        if '-' in value or '_' in value:
+            return base64.urlsafe_b64decode(padded)
+        return base64.b64decode(padded, validate=True)
+    except ValueError:
+        raise BuildError('invalid base64 value') from None
+
+
+def _to_enum(field, value):
+    if isinstance(value, str):
+        enum_value = field.enum_type.values_by_name.get(value)
+        if enum_value is None:
+            raise BuildError(f'unknown value {value!r} of enum {field.enum_type.full_name}')
+        return enum_value.number
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise BuildError(f'expected enum name or number, got {value!r}')
+
+
+# cpp type: (converter, type of json values which are set as they are)
+_CONVERTERS = {
+    FieldDescriptor.CPPTYPE_INT32: (_to_int, None),  # Range is checked
+    FieldDescriptor.CPPTYPE_INT64: (_to_int, None),
+    FieldDescriptor.CPPTYPE_UINT32: (_to_int, None),
+    FieldDescriptor.CPPTYPE_UINT64: (_to_int, None),
+    FieldDescriptor.CPPTYPE_FLOAT: (_to_float, float),
+    FieldDescriptor.CPPTYPE_DOUBLE: (_to_float, float),
+    FieldDescriptor.CPPTYPE_BOOL: (_to_bool, bool),
+    FieldDescriptor.CPPTYPE_ENUM: (_to_enum, int),
+}
+
+
+def _converter(field) -> tuple:
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return _to_bytes, None
+    if field.type == FieldDescriptor.TYPE_STRING:
+        return _to_string, str
+    return _CONVERTERS[field.cpp_type]
+
+
+def _map_key(field, key: str):
+    """Json map keys are strings, they are converted to the key type"""
+
+    if field.cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+        if key not in ('true', 'false'):
+            raise BuildError(f'expected "true" or "false" map key, got {key!r}')
+        return key == 'true'
+    if field.cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        return key
+    return _to_int(field, key)
+
+
+# Well-known types which have their own json forms
+_SPECIAL_TYPES = frozenset('google.protobuf.' + name for name in (
+    'Any', 'Timestamp', 'Duration', 'FieldMask', 'Struct', 'Value', 'ListValue',
+    'DoubleValue', 'FloatValue', 'Int64Value', 'UInt64Value', 'Int32Value',
+    'UInt32Value', 'BoolValue', 'StringValue', 'BytesValue'))
+
+
+def is_special(descriptor) -> bool:
+    """Json of these types is not an object of their fields"""
+    return descriptor.full_name in _SPECIAL_TYPES
+
+
+SCALAR, REPEATED_SCALAR, MESSAGE, REPEATED_MESSAGE, MAP = range(5)
+
+
+class _Field:
+    """Compiled field: how to set a json value to it"""
+
+    __slots__ = ('descriptor', 'name', 'kind', 'convert', 'plain_type', 'oneof')
+
+    def __init__(self, field):
+        self.descriptor = field
+        self.name = field.name
+        self.oneof = None if field.containing_oneof is None else field.containing_oneof.name
+        self.convert = self.plain_type = None
+        repeated = is_repeated(field)
+        if field.cpp_type != FieldDescriptor.CPPTYPE_MESSAGE:
+            self.kind = REPEATED_SCALAR if repeated else SCALAR
+            self.convert, self.plain_type = _converter(field)
+        elif field.message_type.GetOptions().map_entry:
+            self.kind = MAP
+        else:
+            self.kind = REPEATED_MESSAGE if repeated else MESSAGE
+
+
+class _Plan:
+    """Fields of one message descriptor by their json keys"""
+
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+        self.is_special = is_special(descriptor)
+        self.fields = {}
+        for field in descriptor.fields:
+            compiled = _Field(field)
+            self.fields[field.name] = compiled
+            self.fields[field.json_name] = compiled
+        for field in descriptor.fields:  # Real names have priority
+            self.fields.setdefault(_camel_case(field.name), self.fields[field.name])
+
+
+_plans = {}  # {descriptor: _Plan}
+
+
+def _plan(descriptor) -> _Plan:
+    plan = _plans.get(descriptor)
+    if plan is None:
+        plan = _plans[descriptor] = _Plan(descriptor)
+    return plan
+
+
+def field_of(descriptor, key: str):
+    """Returns field descriptor of the json key, as build finds it, or None"""
+
+    fields = _plan(descriptor).fields
+    field = fields.get(key) or fields.get(_camel_case(key))
+    return None if field is None else field.descriptor
+
+
+def _fill(message, json_obj) -> None:
+    plan = _plan(message.DESCRIPTOR)
+    if plan.is_special:
+        try:
+            json_format.ParseDict(json_obj, message)
+        except json_format.ParseError as e:
+            raise BuildError(str(e)) from None
+        return
+    if not isinstance(json_obj, dict):
+        raise BuildError(f'expected object for {plan.descriptor.full_name}, '
+                         f'got {type(json_obj).__name__}')
+
+    fields = plan.fields
+    for key, value in json_obj.items():
+        field = fields.get(key)
+        if field is None:
+            field = fields.get(_camel_case(key))
+            if field is None:
+                raise BuildError(f'message {plan.descriptor.full_name} has no such field',
+                                 [key])
+        if value is None:
+            continue  # Null is the default value
+        try:
+            if field.oneof is not None:
+                which = message.WhichOneof(field.oneof)
+                if which is not None and which != field.name:
+                    raise BuildError(f'oneof {field.oneof} already has field {which}')
+            _set_field(message, field, value)
+        except BuildError as e:
+            e.prepend(key)
+            raise
+        except (TypeError, ValueError) as e:
+            raise BuildError(str(e), [key]) from None
+
+
+def _set_field(message, field: _Field, value) -> None:
+    kind = field.kind
+    if kind == SCALAR:
+        if type(value) is not field.plain_type:
+            value = field.convert(field.descriptor, value)
+        setattr(message, field.name, value)
+
+    elif kind == MESSAGE:
+        sub_message = getattr(message, field.name)
+        sub_message.SetInParent()  # Empty object sets the field too
+        _fill(sub_message, value)
+
+    elif kind == REPEATED_MESSAGE:
+        if not isinstance(value, list):
+            raise BuildError(f'expected list, got {type(value).__name__}')
+        add = getattr(message, field.name).add
+        for index, item in enumerate(value):
+            try:
+                _fill(add(), item)
+            except BuildError as e:
+                e.prepend(index)
+                raise
+
+    elif kind == REPEATED_SCALAR:
+        if not isinstance(value, list):
+            raise BuildError(f'expected list, got {type(value).__name__}')
+        plain_type, convert, descriptor = field.plain_type, field.convert, field.descriptor
+        items = []
+        for index, item in enumerate(value):
+            if type(item) is not plain_type:
+                try:
+                    item = convert(descriptor, item)
+                except BuildError as e:
+                    e.prepend(index)
+                    raise
+            items.append(item)
+        getattr(message, field.name).extend(items)
+
+    else:
+        _set_map(getattr(message, field.name), field.descriptor.message_type, value)
+
+
+def _set_map(container, entry_descriptor, value) -> None:
+    if not isinstance(value, dict):
+        raise BuildError(f'expected object for map, got {type(value).__name__}')
+    key_field = entry_descriptor.fields_by_name['key']
+    value_field = entry_descriptor.fields_by_name['value']
+    is_message = value_field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE
+    if not is_message:
+        convert, plain_type = _converter(value_field)
+    for key, item in value.items():
+        try:
+            map_key = _map_key(key_field, key)
+            if is_message:
+                _fill(container[map_key], item)
+            else:
+                container[map_key] = item if type(item) is plain_type\
+                    else convert(value_field, item)
+        except BuildError as e:
+            e.prepend(key)
+            raise
+
+
+def build(protobuf_msg_type, json_obj):
+    """Returns message of the type filled by json. Required fields
+    may be missed. Raises BuildError naming the wrong field"""
+
+    message = protobuf_msg_type()
+    _fill(message, json_obj)
+    return message
+
+
+def serialize(json_obj, msg_types) -> bytes:
+    """Encodes json by the first of message types that accepts it
+    with all required fields. Raises BuildError of the last type
+    if no one accepts it"""
+
+    error = BuildError('No message types to encode json')
+    for msg_type in msg_types:
+        try:
+            message = build(msg_type, json_obj)
+        except BuildError as e:
+            error = e
+            continue
+        try:
+            return message.SerializeToString()
+        except EncodeError:
+            error = BuildError(f'required field of {msg_type.DESCRIPTOR.full_name}'
+                               f' is missing', [message.FindInitializationErrors()[0]])
+    raise error
@@ -0,0 +1,84 @@
+"""
+Index of generated protobuf message classes. It is built once from
+the classes found in proto_py and gives constant time lookups by
+(module, name), by short name and by full protobuf name.
+With a manifest of proto_py the modules are imported only when
+one of their messages is requested for the first time.
+"""
+
+from google.protobuf import message
+
+
+class MessageRegistry:
+    """Protobuf message classes indexed by module, name and full name"""
+
+    def __init__(self, classes=(), manifest=(), loader=None):
+        self._by_module_name = {}
+        self._by_name = {}
+        self._by_full_name = {}
+        self._loader = loader
+
+        for cls in classes:
+            if isinstance(cls, type) and issubclass(cls, message.Message):
+                self._add(cls.__module__, cls.__name__,
+                          cls.DESCRIPTOR.full_name, cls)
+
+        # Entries of manifest are [import name, name, module, full name]
+        # and are stored as tuples until they are loaded
+        for entry in manifest:
+            self._add(entry[2], entry[1], entry[3], tuple(entry))
+
+        # Short names which are defined in several modules: {name: [module, ..]}
+        self.ambiguous = {name: [self._module_of(item) for item in items]
+                          for name, items in self._by_name.items()
+                          if len(items) > 1}
+
+    def __len__(self):
+        return len(self._by_module_name)
+
+    def _add(self, module: str, name: str, full_name: str, item) -> None:
+        key = (module, name)
+        if key in self._by_module_name:
+            return
+        self._by_module_name[key] = item
+        self._by_name.setdefault(name, []).append(item)
+        self._by_full_name.setdefault(full_name, item)
+
+    @staticmethod
+    def _module_of(item) -> str:
+        return item[2] if isinstance(item, tuple) else item.__module__
+
+    def _resolve(self, item):
+        """Returns class of the item importing its module if it is needed"""
+
+        if not isinstance(item, tuple):
+            return item
+        cls = self._loader(item)
+        module, name, full_name = item[2], item[1], item[3]
+        # Replaces the entry by class in all indexes
+        self._by_module_name[(module, name)] = cls
+        self._by_name[name] = [cls if i is item else i for i in self._by_name[name]]
+        if self._by_full_name.get(full_name) is item:
+            self._by_full_name[full_name] = cls
+        return cls
+
+    def find(self, name: str, module: str = None):
+        """Returns message class by its name and module. Without module
+        the name may be a short name or a full protobuf name. For
+        ambiguous short names the first found class is returned"""
+
+        if module is not None:
+            item = self._by_module_name.get((module, name))
+        else:
+            items = self._by_name.get(name)
+            item = items[0] if items else self._by_full_name.get(name)
+        return None if item is None else self._resolve(item)
+
+    def find_by_full_name(self, full_name: str):
+        """Returns message class by its full protobuf name"""
+        item = self._by_full_name.get(full_name)
+        return None if item is None else self._resolve(item)
+
+    def classes(self) -> list:
+        """Returns all message classes. It imports all lazy modules"""
+        return [self._resolve(item) for item in list(self._by_module_name.values())]
@@ -0,0 +1,193 @@
+"""
+Runtime metrics of the addon: hits of config rules and API rules,
+misses, and latency histograms of processing stages. Histograms have
+power of two buckets of nanoseconds, so recording a value is a few
+integer operations. Metrics are read by the 'rewriter.stats' command
+and exported to a Prometheus text or json file.
+"""
+
+import json
+import os
+import time
+
+# 'match' is matching of config rules, it is recorded once per flow by the
+# request hook. 'match_api' is matching of API rules
+STAGES = ('match', 'match_api', 'decode', 'encode', 'io')
+BUCKETS = 40  # The last bucket takes values from 2^38 ns (~4.6 minutes)
+
+
+def _no_clock() -> float:
+    return 0.0
+
+
+class Histogram:
+    """Counts of values in buckets [2^(i-1), 2^i) nanoseconds"""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0  # Seconds
+
+    def observe(self, seconds: float) -> None:
+        index = int(seconds * 1e9).bit_length()
+        self.buckets[index if index < BUCKETS else BUCKETS - 1] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def bounds(self) -> list:
+        """Returns (upper bound in seconds, cumulative count) for buckets"""
+
+        result = []
+        total = 0
+        for index, count in enumerate(self.buckets[:-1]):
+            total += count
+            result.append(((1 << index) / 1e9, total))
+        return result
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': {f'{bound:.9g}': count for bound, count in self.bounds()}}
+
+
+def _rule_label(rule) -> str:
+    methods = rule.get('method', None) or ['*']
+    if isinstance(methods, str):  # Rules take one method as a string too
+        methods = [methods]
+    return (f'{rule.get("authority_expr", "") or "*"}'
+            f'{rule.get("path_expr", "") or "/*"} '
+            f'{",".join(methods)}')
+
+
+def _api_label(api_entry) -> str:
+    return (f'{api_entry.file_name}:{api_entry.rule.get("path", "")} '
+            f'{api_entry.rule.get("method", None) or "*"}')
+
+
+def _escape_label(value: str) -> str:
+    """Escapes label value as the Prometheus text format does:
+    only backslash, double quote and line feed. Other characters
+    are written as they are in UTF-8"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _add_hits(totals: dict, hits: dict, label) -> None:
+    for item, count in list(hits.values()):
+        key = label(item)
+        totals[key] = totals.get(key, 0) + count
+
+
+class Metrics:
+    """Counters and histograms. If it is disabled, clock() returns 0
+    and nothing is recorded. Values are written by the proxy thread,
+    except the 'io' histogram of the capture writer thread"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.clock = time.perf_counter if enabled else _no_clock
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.rule_misses = 0
+        self.api_misses = 0
+        self._rule_hits = {}  # {id(rule): [rule, count]}, rule keeps its id
+        self._api_hits = {}  # {id(api entry): [api entry, count]}
+        self._rule_totals = {}  # {label: count} of folded rules
+        self._api_totals = {}  # {label: count} of folded api entries
+        self._gauges = {}  # {name: function returning {key: number}}
+
+    def add_gauges(self, name: str, read) -> None:
+        """Adds numbers which are read by the function on export"""
+        self._gauges[name] = read
+
+    def observe(self, stage: str, start: float) -> None:
+        """Records time from start, which is a value of clock()"""
+        if start:
+            self.histograms[stage].observe(time.perf_counter() - start)
+
+    def hit_rule(self, rule: dict) -> None:
+        if self.enabled:
+            hits = self._rule_hits.get(id(rule))
+            if hits is None:
+                self._rule_hits[id(rule)] = [rule, 1]
+            else:
+                hits[1] += 1
+
+    def miss_rule(self) -> None:
+        if self.enabled:
+            self.rule_misses += 1
+
+    def hit_api(self, api_entry) -> None:
+        if self.enabled:
+            hits = self._api_hits.get(id(api_entry))
+            if hits is None:
+                self._api_hits[id(api_entry)] = [api_entry, 1]
+            else:
+                hits[1] += 1
+
+    def miss_api(self) -> None:
+        if self.enabled:
+            self.api_misses += 1
+
+    def fold(self) -> None:
+        """Moves hits to counts by labels and forgets the rules. It is
+        called for each new config version, so rules of old versions
+        are not kept"""
+
+        _add_hits(self._rule_totals, self._rule_hits, _rule_label)
+        _add_hits(self._api_totals, self._api_hits, _api_label)
+        self._rule_hits = {}
+        self._api_hits = {}
+
+    def to_dict(self) -> dict:
+        """Returns all metrics. Hits of equal rules are summed"""
+
+        rule_hits = dict(self._rule_totals)
+        _add_hits(rule_hits, self._rule_hits, _rule_label)
+        api_hits = dict(self._api_totals)
+        _add_hits(api_hits, self._api_hits, _api_label)
+        result = {'rule_hits': rule_hits, 'rule_misses': self.rule_misses,
+                  'api_hits': api_hits, 'api_misses': self.api_misses,
+                  'latency_seconds': {stage: histogram.to_dict()
+                                      for stage, histogram in self.histograms.items()}}
+        for name, read in self._gauges.items():
+            result[name] = read()
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Returns metrics in Prometheus text format"""
+
+        data = self.to_dict()
+        lines = ['# TYPE rewriter_rule_hits_total counter']
+        for label, count in sorted(data['rule_hits'].items()):
+            lines.append(f'rewriter_rule_hits_total{{rule="{_escape_label(label)}"}} {count}')
+        lines += ['# TYPE rewriter_rule_misses_total counter',
+                  f'rewriter_rule_misses_total {self.rule_misses}',
+                  '# TYPE rewriter_api_hits_total counter']
+        for label, count in sorted(data['api_hits'].items()):
+            lines.append(f'rewriter_api_hits_total{{api="{_escape_label(label)}"}} {count}')
+        lines += ['# TYPE rewriter_api_misses_total counter',
+                  f'rewriter_api_misses_total {self.api_misses}',
+                  '# TYPE rewriter_latency_seconds histogram']
+        for stage, histogram in self.histograms.items():
+            for bound, count in histogram.bounds():
+                lines.append(f'rewriter_latency_seconds_bucket'
+                             f'{{stage="{stage}",le="{bound:.9g}"}} {count}')
+            lines += [f'rewriter_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}',
+                      f'rewriter_latency_seconds_sum{{stage="{stage}"}} {histogram.sum}',
+                      f'rewriter_latency_seconds_count{{stage="{stage}"}} {histogram.count}']
+        for name in self._gauges:
+            for key, value in data[name].items():
+                lines += [f'# TYPE rewriter_{name}_{key} gauge',
+                          f'rewriter_{name}_{key} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: str) -> None:
+        """Replaces the file by metrics. Files ending with .json get
+        json, others get Prometheus text"""
+
+        content = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(content)
+        os.replace(temp_path, path)
@@ -0,0 +1,96 @@
+"""
+Emulation of bad network conditions set in config rules: delay,
+jitter, loss and bandwidth. Flows are not slept on: they are
+intercepted and resumed by timers of the proxy event loop,
+so any number of waiting flows costs no threads.
+"""
+
+import asyncio
+import random
+import weakref
+from typing import NamedTuple
+
+from mitmproxy import http
+
+
+def _number(rule: dict, key: str) -> float:
+    value = rule.get(key, None)
+    return 0 if value in (None, '') else float(value)
+
+
+class Conditions(NamedTuple):
+    """Network conditions of one rule"""
+    delay: float  # Seconds before the flow goes on
+    jitter: float  # Max random deviation of the delay in seconds
+    loss: float  # Probability for the flow to be killed, from 0 to 1
+    bandwidth: float  # Bytes per second, 0 is unlimited
+
+    @classmethod
+    def from_rule(cls, rule: dict):
+        """Returns conditions of the rule or None if it has no ones"""
+
+        conditions = cls(_number(rule, 'delay'), _number(rule, 'jitter'),
+                         _number(rule, 'loss'), _number(rule, 'bandwidth'))
+        return conditions if any(conditions) else None
+
+    def is_lost(self) -> bool:
+        """Decides whether the flow has to be lost"""
+        return self.loss > 0 and random.random() < self.loss
+
+    def latency(self) -> float:
+        """Returns delay with random jitter"""
+        if self.jitter:
+            return max(0.0, self.delay + random.uniform(-self.jitter, self.jitter))
+        return self.delay
+
+    def transfer_time(self, size: int) -> float:
+        """Returns time of transferring size bytes"""
+        return size / self.bandwidth if self.bandwidth > 0 else 0.0
+
+
+_held = weakref.WeakSet()  # Flows intercepted by the addon, not by the user
+
+
+def intercept(flow: http.HTTPFlow) -> bool:
+    """Pauses the flow until resume_later. Returns False if the user
+    has intercepted it, such flow is left to the user"""
+
+    if flow.intercepted:
+        return flow in _held
+    flow.intercept()
+    _held.add(flow)
+    return True
+
+
+def is_held(flow: http.HTTPFlow) -> bool:
+    """Tells whether the flow is paused by the addon"""
+    return flow in _held
+
+
+def hold(flow: http.HTTPFlow, seconds: float) -> None:
+    """Pauses the flow for the time without blocking the proxy"""
+
+    if seconds > 0 and intercept(flow):
+        resume_later(flow, seconds)
+
+
+def resume_later(flow: http.HTTPFlow, seconds: float) -> None:
+    """Resumes the flow paused by intercept after the time"""
+
+    if seconds <= 0:
+        _resume(flow)
+    else:
+        asyncio.get_event_loop().call_later(seconds, _resume, flow)
+
+
+def _resume(flow: http.HTTPFlow) -> None:
+    if flow in _held:  # Flows of the user are not resumed
+        _held.discard(flow)
+        flow.resume()  # Does nothing if the user has resumed it
+
+
+def kill(flow: http.HTTPFlow) -> None:
+    """Drops the flow as a lost packet"""
+
+    if flow.killable:
+        flow.kill()
@@ -0,0 +1,101 @@
+"""
+Pool of worker processes for decoding and encoding large protobuf
+bodies. Workers import proto_py once at start and then get only bytes
+or a rewrite file path with full names of messages, so big messages
+don't hold the proxy thread. Results come back as asyncio futures.
+"""
+
+import asyncio
+import multiprocessing
+
+import payload_cache
+
+helper = None  # Imported by init_worker
+
+
+def init_worker() -> None:
+    """Initializer of worker processes. Imports helper and preloads
+    all protobuf modules. Scripts with their own pools use it too"""
+
+    global helper
+    import helper
+    helper.registry.classes()
+
+
+def _decode(full_name: str, content: bytes) -> str:
+    return helper.message_to_json(helper.registry.find_by_full_name(full_name),
+                                  content)
+
+
+def _encode(path: str, full_names: tuple) -> tuple:
+    text, signature = payload_cache.read_source(path)
+    msg_types = tuple(helper.registry.find_by_full_name(full_name)
+                      for full_name in full_names)
+    return payload_cache.encode(path, text, msg_types), signature
+
+
+class CodecPool:
+    """Worker processes for bodies not smaller than threshold bytes"""
+
+    def __init__(self, workers: int, threshold: int):
+        self.threshold = threshold
+        # Forking the proxy with its threads and event loop is not safe
+        self._pool = multiprocessing.get_context('spawn').Pool(
+            workers, initializer=init_worker)
+        self._jobs = {}  # {future: AsyncResult} of jobs in flight
+        self._encoding = {}  # {(path, full names): future} of encode jobs
+
+    def wants(self, size: int) -> bool:
+        """Decides whether the body of this size goes to workers"""
+        return size >= self.threshold
+
+    def decode(self, protobuf_msg_type, content: bytes) -> asyncio.Future:
+        """Decodes protobuf content to json string in a worker"""
+        return self._submit(_decode, (protobuf_msg_type.DESCRIPTOR.full_name,
+                                      content))
+
+    def encode(self, path: str, msg_types: tuple) -> asyncio.Future:
+        """Encodes the rewrite file by message types in a worker.
+        The result is (payload, file signature) for the payload cache.
+        Flows waiting for the same file share one job"""
+
+        full_names = tuple(msg_type.DESCRIPTOR.full_name for msg_type in msg_types)
+        key = (path, full_names)
+        future = self._encoding.get(key)
+        if future is None:
+            future = self._encoding[key] = self._submit(_encode, key)
+            future.add_done_callback(lambda _: self._encoding.pop(key, None))
+        return future
+
+    def result(self, future: asyncio.Future):
+        """Returns the result of a finished job, even if the event loop
+        has not set it to the future yet. Raises the error of the job"""
+
+        if future.done():
+            return future.result()
+        return self._jobs[future].get()
+
+    def close(self) -> None:
+        """Waits for jobs in flight and stops all workers"""
+        self._pool.close()
+        self._pool.join()
+
+    def _submit(self, func, args) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def set_result(result):
+            if not future.done():
+                future.set_result(result)
+
+        def set_exception(exception):
+            if not future.done():
+                future.set_exception(exception)
+
+        # Callbacks are called from the result thread of the pool
+        self._jobs[future] = self._pool.apply_async(
+            func, args,
+            callback=lambda result: loop.call_soon_threadsafe(set_result, result),
+            error_callback=lambda e: loop.call_soon_threadsafe(set_exception, e))
+        future.add_done_callback(self._jobs.pop)
+        return future
@@ -0,0 +1,152 @@
+"""
+Partial rewrites of responses. A patch is a partial json from a file
+and field path overrides of the rule. It is compiled once to protobuf
+bytes and applied to the upstream message: merged into the decoded
+message, or appended to the original bytes, since the last value of
+a singular field wins on the wire. In both ways repeated fields of
+the patch are added to the upstream ones.
+"""
+
+import json
+
+from google.protobuf.descriptor import FieldDescriptor
+
+import classifier
+import message_builder
+
+# Zero values of fields by their wire types
+_ZEROS = {
+    classifier.VARINT: b'\x00',
+    classifier.FIXED64: bytes(8),
+    classifier.LENGTH_DELIMITED: b'\x00',  # Empty string or bytes
+    classifier.FIXED32: bytes(4),
+}
+
+
+def expand_fields(fields: dict) -> dict:
+    """Turns {'a.b.c': value} to {'a': {'b': {'c': value}}}"""
+
+    result = {}
+    for path, value in fields.items():
+        node = result
+        *parents, name = path.split('.')
+        for parent in parents:
+            node = node.setdefault(parent, {})
+            if not isinstance(node, dict):
+                raise ValueError(f'Field {parent!r} of path {path!r} is not a message')
+        node[name] = value
+    return result
+
+
+def merge_json(base: dict, overrides: dict) -> dict:
+    """Returns base with overrides merged into it recursively"""
+
+    result = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_json(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _tag(number: int, wire_type: int) -> bytes:
+    return _varint(number << 3 | wire_type)
+
+
+def explicit_defaults(msg, json_obj) -> bytes:
+    """Encodes fields of json which are set to their default value but
+    are not serialized, because they have no presence (proto3 scalars
+    like {"count": 0} or {"name": ""}). Fields of nested messages are
+    encoded as one more copy of the message, the parser merges them"""
+
+    descriptor = msg.DESCRIPTOR
+    if not isinstance(json_obj, dict) or message_builder.is_special(descriptor):
+        return b''
+    present = {field.number for field, _ in msg.ListFields()}
+    encoded = bytearray()
+    for key, value in json_obj.items():
+        field = message_builder.field_of(descriptor, key)
+        if field is None or value is None or message_builder.is_repeated(field):
+            continue
+        if field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+            nested = explicit_defaults(getattr(msg, field.name), value)
+            if nested:
+                encoded += _tag(field.number, classifier.LENGTH_DELIMITED)
+                encoded += _varint(len(nested)) + nested
+        elif field.number not in present:
+            wire_type = classifier.wire_type(field)
+            encoded += _tag(field.number, wire_type) + _ZEROS[wire_type]
+    return bytes(encoded)
+
+
+def compile_patch(protobuf_msg_type, json_obj: dict) -> bytes:
+    """Encodes partial json. Required fields may be missed in it.
+    Fields set to default values are encoded too, so they replace
+    the upstream values"""
+
+    msg = message_builder.build(protobuf_msg_type, json_obj)
+    return msg.SerializePartialToString() + explicit_defaults(msg, json_obj)
+
+
+def apply_merge(protobuf_msg_type, content: bytes, patch: bytes) -> bytes:
+    """Decodes content, merges patch into it and encodes it back"""
+
+    msg = protobuf_msg_type()
+    msg.ParseFromString(content)
+    msg.MergeFromString(patch)
+    return msg.SerializeToString()
+
+
+def apply_wire(content: bytes, patch: bytes) -> bytes:
+    """Appends patch to the content without decoding it"""
+    return content + patch
+
+
+def has_patch(rule: dict) -> bool:
+    return (rule.get('patch_content', None) not in (None, '') or
+            rule.get('patch_fields', None) not in (None, ''))
+
+
+class Patches:
+    """Compiled patches of rules. A patch is compiled again
+    only if the rule or its patch file is changed"""
+
+    def __init__(self, payload_cache):
+        self.payload_cache = payload_cache
+        self._compiled = {}  # {(id(rule), message name): (rule, signature, patch)}
+
+    def clear(self) -> None:
+        self._compiled.clear()
+
+    def get(self, rule: dict, path: str, protobuf_msg_type) -> bytes:
+        """Returns patch bytes of the rule. Path is the full path
+        of patch_content file or None. Raises ValueError,
+        EnvironmentError or BuildError for invalid patches"""
+
+        signature = None
+        if path is not None:
+            text, signature = self.payload_cache.source(path)
+
+        key = (id(rule), protobuf_msg_type.DESCRIPTOR.full_name)
+        compiled = self._compiled.get(key)
+        # The rule is kept in the entry, so its id is not reused
+        if compiled is not None and compiled[0] is rule and compiled[1] == signature:
+            return compiled[2]
+
+        json_obj = {} if path is None else json.loads(text)
+        fields = rule.get('patch_fields', None)
+        if fields not in (None, ''):
+            json_obj = merge_json(json_obj, expand_fields(fields))
+        patch = compile_patch(protobuf_msg_type, json_obj)
+        self._compiled[key] = (rule, signature, patch)
+        return patch
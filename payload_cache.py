@@ -0,0 +1,184 @@
+"""
+Cache of ready to send rewrite payloads. Files from the fake server
+directory are read, converted and serialized only once, then responses
+get the final bytes. Payloads are also kept compressed by content
+encodings of responses, so they are not compressed again for each one.
+Entries are checked against the file mtime and size, and the least
+recently used ones are evicted when the cache grows over its byte budget.
+"""
+
+import gzip
+import json
+import os
+import time
+import zlib
+from collections import OrderedDict
+
+import message_builder
+
+try:
+    import brotli
+except ImportError:  # Brotli is a dependency of mitmproxy, but it is optional here
+    brotli = None
+
+TEXT_TYPES = ('text',)
+
+# Content encodings of precompressed payloads. A payload is compressed
+# in the response hook on each cache miss: the first response after
+# a file change or an eviction. Moderate levels keep that fast, the best
+# ones take seconds for big payloads and add only a few percent
+ENCODERS = {
+    'gzip': lambda payload: gzip.compress(payload, compresslevel=6),
+    'deflate': lambda payload: zlib.compress(payload, 6),
+}
+if brotli is not None:
+    ENCODERS['br'] = lambda payload: brotli.compress(payload, quality=5)
+
+
+class PayloadError(Exception):
+    """Rewrite file cannot be read or encoded"""
+
+
+class _Entry:
+    __slots__ = ('payload', 'signature', 'checked', 'size')
+
+    def __init__(self, payload, signature, checked):
+        self.payload = payload
+        self.signature = signature
+        self.checked = checked
+        self.size = len(payload)
+
+
+def _signature(path: str) -> tuple:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_source(path: str) -> tuple:
+    """Returns text of the rewrite file and its signature"""
+
+    try:
+        signature = _signature(path)
+        with open(path) as content_file:
+            return content_file.read(), signature
+    except OSError as e:
+        raise PayloadError(f'Cannot read {path}: {e}') from e
+
+
+def encode(path: str, text: str, msg_types: tuple):
+    """Returns payload of the rewrite file text for message types"""
+
+    if msg_types == TEXT_TYPES:
+        return text
+    try:
+        return message_builder.serialize(json.loads(text), msg_types)
+    except Exception as e:
+        raise PayloadError(f'Cannot encode {path}: {e}') from e
+
+
+class PayloadCache:
+    """LRU cache of payloads keyed by (file path, message types, content encoding).
+    Payload is the text for 'text' messages and wire bytes for others.
+    Files are checked for changes not often than once per check_interval"""
+
+    def __init__(self, max_bytes: int, check_interval: float = 1.0):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Drops all entries"""
+        self._entries.clear()
+        self.size = 0
+
+    def get(self, path: str, msg_types: tuple, content_encoding: str = None):
+        """Returns payload of the file encoded by the first of message
+        types that accepts it and compressed by one of ENCODERS if
+        content encoding is set. Raises PayloadError if it is impossible"""
+
+        return self._get(path, msg_types, content_encoding)[0]
+
+    def _get(self, path: str, msg_types: tuple, content_encoding: str = None) -> tuple:
+        """Returns payload and signature of the file it is made of"""
+
+        key = (path, msg_types, content_encoding)
+        entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(path, entry):
+            self._entries.move_to_end(key)
+            return entry.payload, entry.signature
+
+        if content_encoding is None:
+            text, signature = self.source(path)
+            payload = encode(path, text, msg_types)
+        else:
+            payload, signature = self._get(path, msg_types)
+            payload = ENCODERS[content_encoding](payload)
+        self._store(key, payload, signature)
+        return payload, signature
+
+    def lookup(self, path: str, msg_types: tuple):
+        """Returns cached payload if it is up to date or None"""
+
+        key = (path, msg_types, None)
+        entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(path, entry):
+            self._entries.move_to_end(key)
+            return entry.payload
+        return None
+
+    def put(self, path: str, msg_types: tuple, payload, signature: tuple) -> None:
+        """Stores payload encoded somewhere else, e.g. in worker process"""
+        self._store((path, msg_types, None), payload, signature)
+
+    def warm_up(self, paths) -> list:
+        """Reads files in advance, so first responses don't wait for
+        the disk. Returns errors for files that cannot be read"""
+
+        errors = []
+        for path in paths:
+            try:
+                self.source(path)
+            except PayloadError as e:
+                errors.append(str(e))
+        return errors
+
+    def _is_fresh(self, path: str, entry: _Entry) -> bool:
+        now = time.monotonic()
+        if now - entry.checked < self.check_interval:
+            return True
+        try:
+            signature = _signature(path)
+        except OSError:
+            return False
+        entry.checked = now
+        return signature == entry.signature
+
+    def source(self, path: str) -> tuple:
+        """Returns the file text and signature.
+        Text is cached with None as message types"""
+
+        key = (path, None, None)
+        entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(path, entry):
+            self._entries.move_to_end(key)
+            return entry.payload, entry.signature
+        text, signature = read_source(path)
+        self._store(key, text, signature)
+        return text, signature
+
+    def _store(self, key, payload, signature) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+        entry = _Entry(payload, signature, time.monotonic())
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
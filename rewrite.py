@@ -4,8 +4,14 @@ In this file only sets paths to other files (data, configs, etc)
 and initiates the addon.
 """
 
+import os
+
 import rewrite_core
 
+# Run without the Tkinter window, for mitmdump and servers without display.
+# Config is changed by files and rewriter.* commands then
+HEADLESS = os.environ.get('REWRITER_HEADLESS', '') not in ('', '0')
+
 # Way to addons configuration file
 
 CONFIG_FILE_PATH = 'data/config.json'
@@ -21,10 +27,44 @@ SAVING_DIR = 'data/saves'
 API_RULES_DIR = 'data/api_rules'
 # Name of example api rules file. Works only if there are no one other
 EXAMPLE_API_RULES_DIR = 'data/api_rules/example'
+# Max size of serialized rewrite payloads kept in memory
+PAYLOAD_CACHE_BYTES = 64 * 1024 * 1024
+# Read all rewrite files into the payload cache when the addon starts
+WARM_UP_PAYLOADS = True
+# Max count of captures waiting to be written to SAVING_DIR
+CAPTURE_QUEUE_SIZE = 1024
+# What to do with captures when the queue is full: 'drop', 'block' or 'spill'
+CAPTURE_OVERFLOW = 'drop'
+# When to fsync captured files: 'never', 'batch' or 'always'
+CAPTURE_FSYNC = 'never'
+# Worker processes for decoding and encoding big protobuf bodies, 0 is off
+CODEC_WORKERS = 0
+# Bodies and rewrite files of this size and bigger go to the workers
+CODEC_THRESHOLD = 1024 * 1024
+# Count hits of rules and latencies, see the 'rewriter.stats' command
+METRICS_ENABLED = True
+# File to export metrics to: '.json' or Prometheus text for others. None is off
+METRICS_EXPORT_PATH = None
+# Seconds between metrics exports
+METRICS_EXPORT_INTERVAL = 10
+# Endpoints (host, path, method) which keep their found rules, 0 is off
+DECISION_CACHE_SIZE = 4096
 
 addons = [
     rewrite_core.Rewriter(CONFIG_FILE_PATH, SAVING_DIR,
                           REWRITING_DIR, API_RULES_DIR,
                           EXAMPLE_CONFIG_FILE_PATH, EXAMPLE_REWRITING_DIR,
-                          EXAMPLE_API_RULES_DIR)
+                          EXAMPLE_API_RULES_DIR,
+                          payload_cache_bytes=PAYLOAD_CACHE_BYTES,
+                          warm_up_payloads=WARM_UP_PAYLOADS,
+                          capture_queue_size=CAPTURE_QUEUE_SIZE,
+                          capture_overflow=CAPTURE_OVERFLOW,
+                          capture_fsync=CAPTURE_FSYNC,
+                          codec_workers=CODEC_WORKERS,
+                          codec_threshold=CODEC_THRESHOLD,
+                          metrics_enabled=METRICS_ENABLED,
+                          metrics_export_path=METRICS_EXPORT_PATH,
+                          metrics_export_interval=METRICS_EXPORT_INTERVAL,
+                          decision_cache_size=DECISION_CACHE_SIZE,
+                          headless=HEADLESS)
 ]
@@ -5,72 +5,49 @@ They are imports automatically by from proto_py import *
 """
 
 import asyncio
-import json
+import functools
 import os
-import re
-from os import listdir, unlink
+import weakref
 from urllib.parse import urlparse
 
+from mitmproxy import command
 from mitmproxy import ctx
+from mitmproxy import exceptions
 from mitmproxy import http
 
-import GUI
+import capture_writer
+import classifier
+import decision_cache
 import helper
+import matching
+import metrics
+import network
+import offload
+import patching
+import payload_cache
+import snapshot
+import streaming
+import watcher
 
 # FIX: After the first reboot of the addon, the closure of the gui breaks
 
 
 # By this name we can find this addon in addon manager
 script_name = 'rewrite.py'
+# Seconds between checks of config and api rules files
 ReloadInterval = 1
+# mitmproxy 7 renamed HTTPResponse to Response
+Response = getattr(http, 'Response', None) or http.HTTPResponse
 
 
-def reload_addon() -> None:
-    """Func reloads this addon"""
+def toggled(config: tuple, index: int) -> list:
+    """Returns config with the rule turned on or off"""
 
-    addon = ctx.master.addons.get('scriptmanager:' + script_name)
-    addon.loadscript()
-
-
-async def watch(config_file_path):
-    """Task watches for some conditions, than calls addon reload"""
-    last_mtime = 0
-    while True:
-        try:
-            mtime = os.stat(config_file_path).st_mtime
-        except FileNotFoundError:
-            ctx.log.info('Removing script' + script_name)
-            scripts = list(ctx.options.scripts)
-            scripts.remove('rewrite.py')
-            ctx.options.update(scripts=scripts)
-            return
-        if last_mtime == 0:
-            last_mtime = mtime
-        if mtime > last_mtime:
-            last_mtime = mtime  # Don't need to repeat this steps
-            reload_addon()
-
-        await asyncio.sleep(ReloadInterval)
-
-
-class SingletonWatcher(object):
-    """Singleton class for running watching
-    task that reloads addon by the condition"""
-
-    def __new__(cls):
-        if not hasattr(cls, 'instance'):
-            cls.instance = super(SingletonWatcher, cls).__new__(cls)
-        return cls.instance
-
-    def start(self, config_file_path):
-        self.task = asyncio.ensure_future(watch(config_file_path))
-
-    def stop(self):
-        if self.task:
-            self.task.cancel()
-
-
-# singleton_watcher = SingletonWatcher() # Temporarily disabled
+    config = list(config)
+    if index < len(config):
+        rule = config[index] = dict(config[index])
+        rule['is_on'] = not rule.get('is_on', True)
+    return config
 
 
 class Rewriter:
@@ -79,10 +56,39 @@ class Rewriter:
     def __init__(self, config_file_path: str, saving_dir: str,
                  rewriting_dir: str, api_rules_dir: str,
                  example_config_file_path: str, example_rewriting_dir: str,
-                 example_api_rules_dir: str):
+                 example_api_rules_dir: str,
+                 payload_cache_bytes: int = 64 * 1024 * 1024,
+                 warm_up_payloads: bool = False,
+                 capture_queue_size: int = 1024,
+                 capture_overflow: str = 'drop',
+                 capture_fsync: str = 'never',
+                 codec_workers: int = 0,
+                 codec_threshold: int = 1024 * 1024,
+                 metrics_enabled: bool = True,
+                 metrics_export_path: str = None,
+                 metrics_export_interval: float = 10,
+                 decision_cache_size: int = 4096,
+                 headless: bool = False):
 
         ctx.log.info('Creating addon object')
         has_error_in_init = False
+        self.gui = None
+        self.capture_writer = None
+        self.codec_pool = None
+        self._decoding = {}  # {future: path} of captures decoded by workers
+        self.store = None
+        self._reported_version = 0
+        self._flow_snapshots = weakref.WeakKeyDictionary()
+        self._local_flows = weakref.WeakSet()  # Answered by the request hook
+        self.watch_task = None
+        self.export_task = None
+        self.metrics = metrics.Metrics(metrics_enabled)
+        self.decisions = None
+        if decision_cache_size > 0:
+            self.decisions = decision_cache.DecisionCache(decision_cache_size)
+            self.metrics.add_gauges('decision_cache', self.decisions.stats)
+        self.metrics_export_path = metrics_export_path
+        self.metrics_export_interval = metrics_export_interval
 
         if os.path.isfile(config_file_path):
             self.config_file_path = config_file_path
@@ -93,43 +99,21 @@ class Rewriter:
             self.rewriting_dir = example_rewriting_dir
             self.api_rules_dir = example_api_rules_dir
 
-        try:
-            with open(self.config_file_path) as config:
-                try:
-                    config_json = json.load(config)
-                except json.JSONDecodeError:
-                    ctx.log.error(f'Cannot decode json config in {self.config_file_path}, please check it.')
-                    has_error_in_init = True
-        except EnvironmentError:
-            ctx.log.error(f'File {self.config_file_path} not found. It is needed to work with the addon.')
-            has_error_in_init = True
-
         self.saving_dir = saving_dir
-
-        api_map = []  # list of tuples [(json, string_file_name), ..]
-        api_files = [f for f in listdir(self.api_rules_dir) if
-                     os.path.isfile(os.path.join(self.api_rules_dir, f))]
-        for api_file in api_files:
-            try:
-                with open(os.path.join(self.api_rules_dir, api_file)) as json_api_rule:
-                    try:
-                        api_rule = json.load(json_api_rule)
-                    except json.JSONDecodeError:
-                        # Excluding invalid configs with error
-                        ctx.log.error(f'Cannot decode json config in {os.path.join(self.api_rules_dir, api_file)}'
-                                      f', please check it.')
-                        continue
-                    #api_rule.update({"file_path": api_file})
-                    api_map.append((api_rule, api_file))
-            except EnvironmentError:
-                # Unnecessary exception. We compile a list of files according to data from the system.
-                # They must exist
-                ctx.log.error(f'File {os.path.join(self.api_rules_dir, api_file)} not found.'
-                              f' It is needed to work with the addon.')
-                has_error_in_init = True
-
-        # singleton_watcher.start(self.config_file_path)  # Temporarily disabled
-        # ctx.log.info('Created new reloading watcher')
+        self.payload_cache = payload_cache.PayloadCache(payload_cache_bytes)
+        self.patches = patching.Patches(self.payload_cache)
+        self.classifier = classifier.Classifier(helper.registry.classes)
+        self.classifier_loading = None
+
+        self.watcher = watcher.ConfigWatcher(self.config_file_path,
+                                             self.api_rules_dir)
+        self.watcher.poll()
+        for error in self.watcher.errors:
+            ctx.log.error(error)
+        if self.watcher.config is None:
+            has_error_in_init = True
+        config_json = self.watcher.config
+        api_map = self.watcher.api_map
 
         if has_error_in_init:
             ctx.log.error(f'Cannot load the addon {script_name}.'
@@ -138,126 +122,506 @@ class Rewriter:
             ctx.master.addons.remove(addon)
             return
 
-        self.gui = GUI.GUI(config_json, api_map)
-        ctx.log.info("Created new GUI")
+        if warm_up_payloads:
+            self.warm_up_payloads(config_json)
+
+        self.capture_writer = capture_writer.CaptureWriter(
+            capture_queue_size, capture_overflow, capture_fsync,
+            io_histogram=self.metrics.histograms['io'] if metrics_enabled else None)
+
+        if codec_workers > 0:
+            self.codec_pool = offload.CodecPool(codec_workers, codec_threshold)
+
+        for name, modules in helper.registry.ambiguous.items():
+            ctx.log.warn(f'Protobuf message {name} is defined in several modules: '
+                         f'{", ".join(modules)}. Rules without "module" use the '
+                         f'one from {modules[0]}.')
+
+        self.store = snapshot.SnapshotStore(config_json, api_map,
+                                            helper.find_protobuf_message_class)
+        self.current_snapshot()  # Reports errors of the first version
+
+        if headless:
+            ctx.log.info('Running without GUI. Edit config files or use rewriter.* commands')
+        else:
+            import GUI  # Tkinter is not needed without GUI
+            self.gui = GUI.GUI(self.store)
+            ctx.log.info("Created new GUI")
+
+    def running(self):
+        """This method runs when the proxy is up"""
+        if self.store is None:  # The addon is not loaded
+            return
+        if self.watch_task is None:
+            self.watch_task = asyncio.ensure_future(self.watch_files())
+        if self.metrics_export_path and self.export_task is None:
+            self.export_task = asyncio.ensure_future(self.export_metrics())
+
+    async def export_metrics(self) -> None:
+        """Task writes metrics to the export file periodically"""
+
+        while True:
+            await asyncio.sleep(self.metrics_export_interval)
+            try:
+                self.metrics.export(self.metrics_export_path)
+            except OSError as e:
+                ctx.log.error(f'Cannot export metrics to {self.metrics_export_path}: {e}')
+
+    @command.command('rewriter.stats')
+    def stats(self) -> str:
+        """Returns hits of rules and latency histograms as json"""
+        return self.metrics.to_json()
+
+    async def watch_files(self) -> None:
+        """Task applies changes of config and api rules files. They are
+        published as a new snapshot with matching structures compiled
+        here, not in the hooks"""
+
+        while True:
+            await asyncio.sleep(ReloadInterval)
+            published = self.apply_file_changes()
+            if published is not None:
+                await asyncio.wait([published])  # Polls don't overlap
+
+    def apply_file_changes(self, force: bool = False) -> asyncio.Future:
+        """Method reads changed files, or all of them if force is set,
+        and publishes them as a new snapshot in background.
+        Returns the future of publishing or None if nothing is changed"""
+
+        is_config_changed, is_api_map_changed = self.watcher.poll(force)
+        for error in self.watcher.errors:
+            ctx.log.error(error)
+        if not (is_config_changed or is_api_map_changed):
+            return None
+
+        api_map = None
+        if is_api_map_changed:
+            api_map = functools.partial(watcher.merge_api_changes,
+                                        changed_apis=self.watcher.changed_apis,
+                                        removed_apis=self.watcher.removed_apis)
+        messages = []
+        if is_config_changed:
+            messages.append(f'Config is reloaded from {self.config_file_path}')
+        if is_api_map_changed:
+            messages.append(f'API map is reloaded from {self.api_rules_dir}')
+        return self.publish_in_background(
+            messages, config=self.watcher.config if is_config_changed else None,
+            api_map=api_map)
+
+    def publish_in_background(self, messages, **changes) -> asyncio.Future:
+        """Method publishes a new snapshot in a worker thread, so
+        compiling of big configs does not hold flows. Errors of the new
+        version and the messages are logged when it is ready. Messages
+        may be a function making them from the new snapshot"""
+
+        loop = asyncio.get_event_loop()
+        published = loop.run_in_executor(
+            None, functools.partial(self.store.publish, **changes))
+        published.add_done_callback(functools.partial(self.log_published, messages))
+        return published
+
+    def log_published(self, messages, published: asyncio.Future) -> None:
+        """Callback of publish_in_background"""
+
+        if published.cancelled():
+            return
+        if published.exception() is not None:
+            ctx.log.error(f'Cannot publish a new snapshot: {published.exception()}')
+            return
+        self.current_snapshot()
+        if callable(messages):
+            messages = messages(published.result())
+        for message in messages:
+            ctx.log.info(message)
+
+    @command.command('rewriter.reload')
+    def reload(self) -> None:
+        """Reads config and api rules files again"""
+        self.apply_file_changes(force=True)
+
+    @command.command('rewriter.save')
+    def save(self) -> None:
+        """Writes changed config and api rules to their files"""
+        self.save_config()
+        self.save_api_map()
+
+    @command.command('rewriter.rule.toggle')
+    def toggle_rule(self, index: int) -> None:
+        """Turns on or off the rule by its index in config"""
+
+        rule_count = len(self.store.current.config)
+        if not 0 <= index < rule_count:
+            raise exceptions.CommandError(f'There is no rule #{index}, '
+                                          f'config has {rule_count} rules')
+
+        def messages(new_snapshot):
+            rule = new_snapshot.config[index]
+            return [f'Rule #{index} {rule.get("path_expr", ".*")} is turned '
+                    + ('on' if rule['is_on'] else 'off')]
+
+        self.publish_in_background(messages,
+                                   config=functools.partial(toggled, index=index))
+
+    def current_snapshot(self) -> snapshot.Snapshot:
+        """Method returns the current snapshot without locking.
+        Errors of each new version are logged once"""
+
+        current = self.store.current
+        if current.version != self._reported_version:
+            self._reported_version = current.version
+            self.patches.clear()  # Drops patches of old rules
+            self.metrics.fold()  # Forgets old rules, keeps their counts
+            for error in current.errors:
+                ctx.log.error(f'{error}. Please check it.')
+            self.load_classifier(current.config)
+        return current
+
+    def load_classifier(self, config) -> None:
+        """Method builds signatures of all message types in a worker
+        thread once some rule saves content, so bodies without API rule
+        can be saved as the type they look like"""
+
+        if self.classifier_loading is not None or not any(
+                rule.get('save_content', None) not in (None, '') for rule in config):
+            return
+        ctx.log.info('Indexing message types to save bodies without API rules')
+        self.classifier_loading = asyncio.get_event_loop().run_in_executor(
+            None, self.classifier.load)
+        self.classifier_loading.add_done_callback(self.log_classifier_loaded)
+
+    def log_classifier_loaded(self, loading: asyncio.Future) -> None:
+        """Callback of load_classifier"""
+
+        if not loading.cancelled() and loading.exception() is not None:
+            ctx.log.error(f'Cannot index message types: {loading.exception()}')
+            self.classifier_loading = None  # Tried again by the next version
+
+    def flow_snapshot(self, flow: http.HTTPFlow) -> snapshot.Snapshot:
+        """Method returns the snapshot which the flow started with,
+        so all hooks of one flow use the same version"""
+
+        flow_snapshot = self._flow_snapshots.get(flow)
+        if flow_snapshot is None:
+            flow_snapshot = self._flow_snapshots[flow] = self.current_snapshot()
+        return flow_snapshot
 
     def done(self):
         """This method runs at the end of the addons life"""
-        if self.gui is not None and self.gui.isAlive():
+        if self.watch_task is not None:
+            self.watch_task.cancel()
+        if self.export_task is not None:
+            self.export_task.cancel()
+            try:
+                self.metrics.export(self.metrics_export_path)
+            except OSError as e:
+                ctx.log.error(f'Cannot export metrics to {self.metrics_export_path}: {e}')
+        if self.gui is not None and self.gui.is_alive():
             self.gui.close()
             self.gui.join()
-        # singleton_watcher.stop() # Temporarily disabled
+        if self.codec_pool is not None:
+            self.codec_pool.close()  # Waits for captures being decoded
+            for future, full_path in self._decoding.items():
+                try:
+                    self.capture_writer.save(full_path, self.codec_pool.result(future))
+                except Exception as e:
+                    ctx.log.error(f'Cannot decode content for {full_path}: {e}')
+            self._decoding.clear()
+        if self.capture_writer is not None:
+            self.capture_writer.close()
+            self.log_capture_errors()
+            if self.capture_writer.dropped:
+                ctx.log.warn(f'{self.capture_writer.dropped} captures were dropped'
+                             f' because the writing queue was full')
         ctx.log.info('Closing addon function. Stops all.')
 
-    def save_api_map(self) -> None:
-        """Method saves api map to files"""
+    def warm_up_payloads(self, config_json: list) -> None:
+        """Method reads rewrite files of all rules into the payload cache"""
 
-        # Remove all files
-        for the_file in listdir(self.api_rules_dir):
-            file_path = os.path.join(self.api_rules_dir, the_file)
-            try:
-                if os.path.isfile(file_path):
-                    unlink(file_path)
-            except Exception as e:
-                ctx.log.info(e)
+        paths = {os.path.join(self.rewriting_dir, rule['rewrite_content'])
+                 for rule in config_json
+                 if rule.get('rewrite_content', None) not in (None, '')}
+        for error in self.payload_cache.warm_up(paths):
+            ctx.log.error(error)
+        ctx.log.info(f'Payload cache is warmed up by {len(paths)} files')
 
-        # Creating files and writes jsons to it
-        for api in self.gui.api_map.config:
-            with open(os.path.join(self.api_rules_dir, api[1]), 'w+') as api_file:
-                json.dump(api[0], api_file, indent=4)
+    def log_capture_errors(self) -> None:
+        """Method logs errors of the capture writer thread"""
 
-    def find_api(self, flow: http.HTTPFlow) -> dict:
-        """Method searches for API in config (api_map), that
-        is match to current request. Then returns this API as dictionary."""
+        for error in self.capture_writer.pop_errors():
+            ctx.log.error(error)
 
-        url = urlparse(flow.request.pretty_url)
-        url_authority = url.netloc.split(':', 1)[0]
-        url_path = url.path
-        method = flow.request.method
+    def save_api_map(self) -> None:
+        """Method saves changed API files and removes deleted ones"""
 
-        for api_and_name in self.gui.api_map.config:
-            is_server_found = False  # Flag for searching
+        try:
+            written, removed = self.watcher.save_api_map(self.store.current.api_map)
+        except OSError as e:
+            ctx.log.error(f'Cannot save API map to {self.api_rules_dir}: {e}')
+            return
+        if written or removed:
+            ctx.log.info(f'API map is saved: {len(written)} files written,'
+                         f' {len(removed)} removed')
 
-            api = api_and_name[0]
+    def find_api(self, flow: http.HTTPFlow,
+                 flow_snapshot: snapshot.Snapshot = None) -> matching.ApiEntry:
+        """Method searches for API in config (api_map), that
+        is match to current request. Then returns this API rule
+        resolved with its protobuf message classes."""
 
-            for server in api.get('server'):
-                if re.match(server, url_authority):
-                    is_server_found = True
+        if flow_snapshot is None:
+            flow_snapshot = self.current_snapshot()
 
-            if not is_server_found:
-                continue
+        start = self.metrics.clock()
+        if self.decisions is None:
+            api_entry = self.match_api(flow, flow_snapshot)
+        else:
+            decision = self.decision(flow, flow_snapshot)
+            api_entry = decision[1]
+            if api_entry is decision_cache.UNRESOLVED:
+                api_entry = decision[1] = self.match_api(flow, flow_snapshot)
+        self.metrics.observe('match_api', start)
+        return api_entry
 
-            rules = api.get('rules')
+    @staticmethod
+    def match_api(flow: http.HTTPFlow, flow_snapshot: snapshot.Snapshot) -> matching.ApiEntry:
+        """Method matches the request against the API index"""
 
-            for rule in rules:
-                if (re.match('^/*' + rule.get('path', '.*') + '$', url_path) and
-                        re.match(rule.get('method', '.*'), method)):
-                    return_rule = rule
-                    return_rule.update({"errors": api.get("errors")})
-                    return return_rule
-        return None
+        url = urlparse(flow.request.pretty_url)
+        url_authority = url.netloc.split(':', 1)[0]
+        url_path = url.path
+
+        return flow_snapshot.api_index.match(url_authority, url_path,
+                                             flow.request.method)
 
     def save_config(self) -> None:
-        """Method saves config with rules"""
+        """Method saves config with rules if it is changed"""
 
-        with open(self.config_file_path, 'w+') as config:
-            json.dump(self.gui.config_json.config, config, indent=4)
+        try:
+            is_written = self.watcher.save_config(self.store.current.config)
+        except OSError as e:
+            ctx.log.error(f'Cannot save config to {self.config_file_path}: {e}')
+            return
+        if is_written:
+            ctx.log.info(f'Config is saved to {self.config_file_path}')
 
-    def find_rule(self, flow: http.HTTPFlow) -> dict:
+    def find_rule(self, flow: http.HTTPFlow,
+                  flow_snapshot: snapshot.Snapshot = None) -> dict:
         """Method searches for rule in config, that
         is match to current request. Then returns this rule as a dictionary."""
 
+        if flow_snapshot is None:
+            flow_snapshot = self.current_snapshot()
+
+        if self.decisions is None:
+            return self.match_rule(flow, flow_snapshot)
+        return self.decision(flow, flow_snapshot)[0]
+
+    @staticmethod
+    def match_rule(flow: http.HTTPFlow, flow_snapshot: snapshot.Snapshot) -> dict:
+        """Method matches the request against the config rules"""
+
         url = urlparse(flow.request.pretty_url)
         url_authority = url.netloc.split(':', 1)[0]
         url_path = url.path
 
-        for rule in self.gui.config_json.config:
-            is_on = rule.get('is_on', True)
-            is_match_authority = re.match(rule.get('authority_expr',
-                                                   '.*'), url_authority)
-            is_match_path = re.match('^/*' + rule.get('path_expr', '.*'
-                                                      ) + '$', url_path)
-            is_match_method = flow.request.method in\
-                rule.get('method', ["GET", "POST", "PUT", "DELETE"])
-
-            if not(
-                   is_on and
-                   is_match_authority and
-                   is_match_path and
-                   is_match_method):
-                continue
-
-            return rule
-        return None
-
-# Needs to do something with async. Concurrent is a treat to overflow.
-#    @concurrent
+        return flow_snapshot.rule_matcher.match(url_authority, url_path,
+                                                flow.request.method)
+
+    def decision(self, flow: http.HTTPFlow, flow_snapshot: snapshot.Snapshot) -> list:
+        """Method returns cached [rule, API entry] for the endpoint
+        of the request. The API entry is searched on demand"""
+
+        key = (flow.request.pretty_host, flow.request.path.split('?', 1)[0],
+               flow.request.method)
+        decision = self.decisions.get(flow_snapshot.version, key)
+        if decision is None:
+            decision = [self.match_rule(flow, flow_snapshot), decision_cache.UNRESOLVED]
+            self.decisions.put(flow_snapshot.version, key, decision)
+        return decision
+
     def request(self, flow: http.HTTPFlow) -> None:
         """Method calls when the full HTTP request has been read
         It searches for the eligible rule in config
-        and then replaces request content according to it"""
+        and then emulates network conditions of it"""
 
-    #        rule = self.find_rule(flow)
-    #        if rule is None:
-    #            return
-    #
-    #        # Bad internet settings: delay, loss
-    #
-    #        delay = rule.get('delay', None)
-    #        if delay not in (None, ''):
-    #            time.sleep(delay)
+        flow_snapshot = self.flow_snapshot(flow)
+        # Later hooks find the rule again, the time is recorded only here
+        start = self.metrics.clock()
+        rule = self.find_rule(flow, flow_snapshot)
+        self.metrics.observe('match', start)
+        if rule is None:
+            return
 
-        pass
+        is_local = rule.get('local', False) and\
+            self.answer_locally(flow, rule, flow_snapshot)
+
+        # Bad internet settings: delay, jitter, loss, bandwidth
+        conditions = network.Conditions.from_rule(rule)
+        if conditions is None:
+            return
+        if conditions.is_lost():
+            network.kill(flow)
+            return
+        request_size = len(flow.request.raw_content or b'')
+        seconds = conditions.latency() + conditions.transfer_time(request_size)
+        if is_local:
+            seconds += self.response_transfer_time(flow, rule)
+        network.hold(flow, seconds)
+
+    def answer_locally(self, flow: http.HTTPFlow, rule: dict,
+                       flow_snapshot: snapshot.Snapshot) -> bool:
+        """Method makes the response of the rule from its rewrite file,
+        so the request does not go to the server. Returns False
+        if the response cannot be made"""
+
+        rewrite_content_path = rule.get('rewrite_content', None)
+        if rewrite_content_path in (None, ''):
+            ctx.log.error('Rule with "local" has no "rewrite_content" for this request: '
+                          + flow.request.pretty_url)
+            return False
+
+        api_entry = self.find_message_api(flow, rule, flow_snapshot)
+        if api_entry is None:
+            return False
+
+        status_code = rule.get('status_code', None)
+        if status_code in (None, ''):
+            status_code = 200
+        msg_types = self.message_types(api_entry, status_code)
+        try:
+            payload = self.payload_cache.get(
+                os.path.join(self.rewriting_dir, rewrite_content_path), msg_types)
+        except payload_cache.PayloadError as e:
+            ctx.log.error(str(e))
+            return False
+
+        if msg_types == payload_cache.TEXT_TYPES:
+            headers = {'Content-Type': 'text/plain; charset=utf-8'}
+            payload = payload.encode()
+        else:
+            headers = {'Content-Type': 'application/x-protobuf'}
+        headers.update(rule.get('headers', None) or {})
+        flow.response = Response.make(status_code, payload, headers)
+        self._local_flows.add(flow)
+        return True
+
+    @staticmethod
+    def message_types(api_entry: matching.ApiEntry, status_code: int) -> tuple:
+        """Method returns message types to encode content by:
+        the API rule message for 2xx codes and its errors for others"""
+
+        if api_entry.message_class == 'text':
+            return payload_cache.TEXT_TYPES
+        if 200 <= status_code < 300 or not api_entry.error_classes:
+            return (api_entry.message_class,)
+        return api_entry.error_classes
+
+    def responseheaders(self, flow: http.HTTPFlow) -> None:
+        """Method calls when the HTTP response headers have been read
+        For rules with 'stream' framing it sets frame by frame
+        saving and rewriting of the body instead of buffering it"""
+
+        if flow in self._local_flows:
+            return
+        flow_snapshot = self.flow_snapshot(flow)
+        rule = self.find_rule(flow, flow_snapshot)
+        if rule is None or rule.get('stream', None) in (None, ''):
+            return
+        framing = rule['stream']
+        if framing not in streaming.FRAMINGS:
+            ctx.log.error(f'Unknown stream framing {framing!r}, it must be one of: '
+                          + ', '.join(streaming.FRAMINGS))
+            return
+
+        self.rewrite_status_and_headers(flow, rule)
+
+        api_entry = self.find_message_api(flow, rule, flow_snapshot)
+        if api_entry is None:
+            return
+        protobuf_msg_type = api_entry.message_class
+        if protobuf_msg_type == 'text':
+            ctx.log.error(f'Text content cannot be streamed by {framing} frames: '
+                          + flow.request.pretty_url)
+            return
+
+        save_content_path = rule.get('save_content', None)
+        if save_content_path not in (None, ''):
+            save_content_path = os.path.join(self.saving_dir, save_content_path)
+
+        rewrite_payload = None
+        rewrite_content_path = rule.get('rewrite_content', None)
+        if rewrite_content_path not in (None, ''):
+            try:
+                rewrite_payload = self.payload_cache.get(
+                    os.path.join(self.rewriting_dir, rewrite_content_path),
+                    (protobuf_msg_type,))
+            except payload_cache.PayloadError as e:
+                ctx.log.error(str(e))
+            else:
+                flow.response.headers.pop('content-length', None)
+
+        flow.response.stream = streaming.FrameStream(
+            framing,
+            functools.partial(self.process_frame, flow, rule, protobuf_msg_type,
+                              save_content_path, rewrite_payload),
+            flow.response.headers.get('grpc-encoding', None))
+
+    def process_frame(self, flow: http.HTTPFlow, rule: dict, protobuf_msg_type,
+                      save_content_path: str, rewrite_payload: bytes,
+                      payload: bytes) -> bytes:
+        """Method saves one frame of the streamed response and
+        returns payload to replace it by or None to keep it"""
+
+        if save_content_path is not None:
+            # Stream frames may be processed outside of the event loop
+            self.save_capture(flow, rule, save_content_path,
+                              protobuf_msg_type, payload, offload=False)
+        return rewrite_payload
 
     def response(self, flow: http.HTTPFlow) -> None:
         """Method calls when the full HTTP response has been read
         It searches for the eligible rule in config
         and then replaces response content according to it"""
 
-        rule = self.find_rule(flow)
+        flow_snapshot = self.flow_snapshot(flow)
+        del self._flow_snapshots[flow]
+
+        rule = self.find_rule(flow, flow_snapshot)
         if rule is None:
+            self.metrics.miss_rule()
+            return
+        self.metrics.hit_rule(rule)
+
+        if flow in self._local_flows:
+            # Made by the request hook from the rewrite file
+            self._local_flows.discard(flow)
+            return
+
+        if isinstance(flow.response.stream, streaming.FrameStream):
+            # Already processed frame by frame
+            for error in flow.response.stream.errors:
+                ctx.log.error(f'Stream of {flow.request.pretty_url}: {error}')
+            self.log_capture_errors()
             return
 
+        self.rewrite_response(flow, rule, flow_snapshot)
+
+        if not network.is_held(flow):  # Otherwise it is waiting for a worker
+            network.hold(flow, self.response_transfer_time(flow, rule))
+
+    @staticmethod
+    def response_transfer_time(flow: http.HTTPFlow, rule: dict) -> float:
+        """Method returns time of sending the response by rule bandwidth"""
+
+        conditions = network.Conditions.from_rule(rule)
+        if conditions is None:
+            return 0.0
+        return conditions.transfer_time(len(flow.response.raw_content or b''))
+
+    @staticmethod
+    def rewrite_status_and_headers(flow: http.HTTPFlow, rule: dict) -> None:
+        """Method replaces response status and headers according to the rule"""
+
         status_code = rule.get('status_code', None)
         if status_code not in (None, ''):
             flow.response.status_code = status_code
@@ -267,61 +631,213 @@ class Rewriter:
             for header in headers:
                 flow.response.headers[header] = headers.get(header)
 
+    def find_message_api(self, flow: http.HTTPFlow, rule: dict,
+                         flow_snapshot: snapshot.Snapshot) -> matching.ApiEntry:
+        """Method returns API rule with message type for rules
+        which save or rewrite content. Otherwise returns None"""
+
         if rule.get('save_content', None) in (None, '') and\
-                rule.get('rewrite_content', None) in (None, ''):
-            return
+                rule.get('rewrite_content', None) in (None, '') and\
+                not patching.has_patch(rule):
+            return None
 
-        api_rule = self.find_api(flow)
-        if api_rule is None:
+        api_entry = self.find_api(flow, flow_snapshot)
+        if api_entry is None:
+            self.metrics.miss_api()
             ctx.log.error("Can't find api rule for this request: "
                           + flow.request.pretty_url + ". Please check it in "
                           + self.api_rules_dir + " directory.")
-            return
+            return None
 
-        errors_msg_types = helper.find_errors_protobuf_messages(api_rule)
+        self.metrics.hit_api(api_entry)
 
-        protobuf_msg_type = helper.find_protobuf_message_class(api_rule)
-        if protobuf_msg_type is None:
+        if api_entry.message_class is None:
             ctx.log.error("Can't find protobuf message for this request: "
                           + flow.request.pretty_url + ". Please check it in "
                           + self.api_rules_dir + " directory.")
+            return None
+        return api_entry
+
+    def rewrite_response(self, flow: http.HTTPFlow, rule: dict,
+                         flow_snapshot: snapshot.Snapshot) -> None:
+        """Method replaces response status, headers
+        and content according to the rule"""
+
+        self.rewrite_status_and_headers(flow, rule)
+
+        api_entry = self.find_message_api(flow, rule, flow_snapshot)
+        if api_entry is None:
+            self.save_unmapped(flow, rule)
             return
 
+        errors_msg_types = api_entry.error_classes
+        protobuf_msg_type = api_entry.message_class
+
         # Save block
 
         save_content_path = rule.get('save_content', None)
         if save_content_path not in (None, ''):
-            # Finding free path for saving
             full_path = os.path.join(self.saving_dir, save_content_path)
-            free_path = helper.find_free_name_in_path(full_path)
 
-            # Saving process
+            # Error bodies are saved as the error type they look like
+            save_msg_type = protobuf_msg_type
+            if protobuf_msg_type != 'text' and errors_msg_types and\
+                    not 200 <= flow.response.status_code < 300:
+                save_msg_type = self.classifier.classify(
+                    flow.response.content, errors_msg_types) or protobuf_msg_type
+
+            # Saving process. Files are written by the capture writer thread
             if protobuf_msg_type == 'text':
-                content = flow.response.text
+                self.capture_writer.save(full_path, flow.response.text)
             else:
-                content = helper.save_body_as_json(flow.response,
-                                                   protobuf_msg_type)
-
-            with open(free_path, "w") as save_file:
-                save_file.write(content)
+                self.save_capture(flow, rule, full_path, save_msg_type,
+                                  flow.response.content)
+            self.log_capture_errors()
 
         # Rewrite block
 
         rewrite_content_path = rule.get('rewrite_content', None)
         if rewrite_content_path not in (None, ''):
             # Rewriting process
-            with open(os.path.join(self.rewriting_dir,
-                      rewrite_content_path)) as content_file:
+            msg_types = self.message_types(api_entry, flow.response.status_code)
+
+            full_path = os.path.join(self.rewriting_dir, rewrite_content_path)
+            payload = self.payload_cache.lookup(full_path, msg_types)
+            # Flow waits for the worker without blocking others. Flows
+            # intercepted by the user are encoded here, as they may be resumed
+            if payload is None and self.should_offload_encoding(full_path, msg_types)\
+                    and network.intercept(flow):
+                future = self.codec_pool.encode(full_path, msg_types)
+                future.add_done_callback(functools.partial(
+                    self.rewrite_encoded, flow, rule, full_path, msg_types))
+                return
+
+            content_encoding = flow.response.headers.get('content-encoding', '').strip().lower()
+            if content_encoding not in payload_cache.ENCODERS:
+                content_encoding = None
+            start = self.metrics.clock()
+            try:
                 if protobuf_msg_type == 'text':
-                    text = content_file.read()
-                    flow.response.text = text
+                    flow.response.text = payload or self.payload_cache.get(
+                        full_path, msg_types)
+                elif content_encoding is not None:
+                    # Precompressed payload is sent as is
+                    helper.set_raw_content(flow.response, self.payload_cache.get(
+                        full_path, msg_types, content_encoding))
                 else:
-                    json_obj = json.load(content_file)
-                    helper.camel_json(json_obj)
+                    flow.response.content = payload or self.payload_cache.get(
+                        full_path, msg_types)
+            except payload_cache.PayloadError as e:
+                ctx.log.error(str(e))
+            self.metrics.observe('encode', start)
+
+        # Patch block
+
+        elif (patching.has_patch(rule) and protobuf_msg_type != 'text' and
+              200 <= flow.response.status_code < 300):
+            self.patch_response(flow, rule, protobuf_msg_type)
+
+    def save_unmapped(self, flow: http.HTTPFlow, rule: dict) -> None:
+        """Method saves the body of a response without API rule
+        as the message type guessed by its wire format"""
+
+        save_content_path = rule.get('save_content', None)
+        if save_content_path in (None, '') or not flow.response.content:
+            return
+
+        if not self.classifier.is_loaded:  # Being built by load_classifier
+            ctx.log.warn(f'Response of {flow.request.pretty_url} is not saved: '
+                         f'it has no API rule and message types are not indexed yet')
+            return
+        protobuf_msg_type = self.classifier.classify(flow.response.content)
+        if protobuf_msg_type is None:
+            return
+        ctx.log.info(f'Response of {flow.request.pretty_url} is saved as '
+                     f'{protobuf_msg_type.DESCRIPTOR.full_name} guessed by its wire format')
+        self.save_capture(flow, rule,
+                          os.path.join(self.saving_dir, save_content_path),
+                          protobuf_msg_type, flow.response.content)
+        self.log_capture_errors()
+
+    def save_capture(self, flow: http.HTTPFlow, rule: dict, full_path: str,
+                     protobuf_msg_type, content: bytes, offload: bool = True) -> None:
+        """Method queues protobuf content to be saved as json. With
+        "save_format": "raw" the bytes are saved as they are with a meta
+        file naming the message type, and convert_captures.py turns
+        them to json later. Big contents are decoded by the codec pool
+        if offload is allowed"""
+
+        if rule.get('save_format', None) == 'raw':
+            meta = capture_writer.meta_json(protobuf_msg_type,
+                                            flow.request.pretty_url,
+                                            flow.response.status_code)
+            self.capture_writer.save(
+                capture_writer.raw_path(full_path), content,
+                sidecars=((capture_writer.META_EXTENSION, meta),),
+                extensions=(capture_writer.JSON_EXTENSION,))
+        elif offload and self.codec_pool is not None and\
+                self.codec_pool.wants(len(content)):
+            future = self.codec_pool.decode(protobuf_msg_type, content)
+            self._decoding[future] = full_path
+            future.add_done_callback(self.save_decoded)
+        else:
+            start = self.metrics.clock()
+            json_content = helper.message_to_json(protobuf_msg_type, content)
+            self.metrics.observe('decode', start)
+            self.capture_writer.save(full_path, json_content)
+
+    def patch_response(self, flow: http.HTTPFlow, rule: dict,
+                       protobuf_msg_type) -> None:
+        """Method applies the patch of the rule to the upstream message.
+        With patch_wire it is appended to the original bytes"""
+
+        patch_content_path = rule.get('patch_content', None)
+        full_path = None
+        if patch_content_path not in (None, ''):
+            full_path = os.path.join(self.rewriting_dir, patch_content_path)
 
-                    if 200 <= flow.response.status_code < 300 or not errors_msg_types:
-                        msg_types = [protobuf_msg_type]
-                    else:
-                        msg_types = errors_msg_types
+        try:
+            patch = self.patches.get(rule, full_path, protobuf_msg_type)
+            if rule.get('patch_wire', False):
+                flow.response.content = patching.apply_wire(
+                    flow.response.content, patch)
+            else:
+                flow.response.content = patching.apply_merge(
+                    protobuf_msg_type, flow.response.content, patch)
+        except Exception as e:
+            ctx.log.error(f'Cannot patch response of {flow.request.pretty_url}: {e}')
+
+    def should_offload_encoding(self, path: str, msg_types: tuple) -> bool:
+        """Method decides whether the rewrite file is big
+        enough to be encoded in a worker process"""
+
+        if self.codec_pool is None or msg_types == payload_cache.TEXT_TYPES:
+            return False
+        try:
+            return self.codec_pool.wants(os.path.getsize(path))
+        except OSError:
+            return False
+
+    def save_decoded(self, future: asyncio.Future) -> None:
+        """Method saves content decoded by a worker process"""
+
+        full_path = self._decoding.pop(future, None)
+        if full_path is None:
+            return  # Saved by done()
+        if future.exception() is not None:
+            ctx.log.error(f'Cannot decode content for {full_path}: {future.exception()}')
+            return
+        self.capture_writer.save(full_path, future.result())
 
-                    helper.rewrite_body_by_json(flow.response, json_obj, msg_types)
+    def rewrite_encoded(self, flow: http.HTTPFlow, rule: dict, full_path: str,
+                        msg_types: tuple, future: asyncio.Future) -> None:
+        """Method sets content encoded by a worker process
+        and resumes the flow"""
+
+        if future.exception() is not None:
+            ctx.log.error(str(future.exception()))
+        else:
+            payload, signature = future.result()
+            self.payload_cache.put(full_path, msg_types, payload, signature)
+            flow.response.content = payload
+        network.resume_later(flow, self.response_transfer_time(flow, rule))
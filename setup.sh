@@ -52,6 +52,8 @@ unset IFS; set +f
 
 cp ../init.py "$PYTHON_PROTO_PATH/__init__.py"
 
+python3 -c 'import proto_py; proto_py.write_manifest()' #Manifest for lazy loading mode
+
 set -
 
 cd ..
@@ -0,0 +1,68 @@
+"""
+Versioned snapshots of the addon state. A snapshot holds config rules,
+API map and matching structures compiled for them, and it is never
+changed. Editors (the GUI, the files watcher) publish new snapshots,
+and the proxy reads the current one without any locks.
+"""
+
+import threading
+from typing import NamedTuple
+
+import matching
+
+
+class Snapshot(NamedTuple):
+    """One consistent version of config and API map"""
+    version: int
+    config: tuple  # Rules
+    api_map: tuple  # Tuples (json, string_file_name)
+    rule_matcher: matching.RuleMatcher
+    api_index: matching.ApiIndex
+    errors: tuple  # Errors of compiling new parts of this version
+
+
+class SnapshotStore:
+    """Keeps the current snapshot. Reading of 'current' is a single
+    attribute access, and publishing replaces it by one assignment.
+    Only writers are serialized with each other"""
+
+    def __init__(self, config, api_map, resolve):
+        self._resolve = resolve
+        self._write_lock = threading.Lock()
+        self.current = None
+        self.publish(config, api_map)
+
+    def publish(self, config=None, api_map=None) -> Snapshot:
+        """Makes a new version with the changed parts. Structures
+        are compiled only for the parts which are really changed.
+        Config and API map may be functions making them from the
+        current ones, they are called under the lock"""
+
+        with self._write_lock:
+            old = self.current
+            errors = []
+
+            if callable(config):
+                config = config(old.config)
+            if config is None:
+                config, rule_matcher = old.config, old.rule_matcher
+            else:
+                config = tuple(config)
+                rule_matcher = matching.RuleMatcher(config)
+                errors.extend(rule_matcher.errors)
+
+            if callable(api_map):
+                api_map = api_map(old.api_map)
+            if api_map is None:
+                api_map, api_index = old.api_map, old.api_index
+            else:
+                api_map = tuple(api_map)
+                api_index = matching.ApiIndex(
+                    api_map, self._resolve,
+                    previous=None if old is None else old.api_index)
+                errors.extend(api_index.errors)
+
+            version = 1 if old is None else old.version + 1
+            self.current = Snapshot(version, config, api_map,
+                                    rule_matcher, api_index, tuple(errors))
+            return self.current
@@ -0,0 +1,163 @@
+"""
+Frame by frame processing of streamed protobuf bodies. Two framings
+are supported: gRPC (1 byte compressed flag, 4 bytes big endian length)
+and varint length-delimited messages. Only the current incomplete frame
+is buffered, so memory is bounded by the largest frame, not the stream.
+"""
+
+import gzip
+import struct
+
+GRPC = 'grpc'
+DELIMITED = 'delimited'
+FRAMINGS = (GRPC, DELIMITED)
+
+_GRPC_HEADER = struct.Struct('>BI')
+
+
+def _read_varint(buffer, position: int) -> tuple:
+    """Returns (value, next position) or (None, position) if it is incomplete"""
+
+    result = 0
+    shift = 0
+    while position < len(buffer):
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+        if shift > 63:
+            raise ValueError('Varint of frame length is too long')
+    return None, position
+
+
+def encode_varint(value: int) -> bytes:
+    """Encodes unsigned int as protobuf varint"""
+
+    result = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return bytes(result)
+
+
+def encode_frame(framing: str, payload: bytes, compressed: bool = False) -> bytes:
+    """Returns payload with the frame header"""
+
+    if framing == GRPC:
+        return _GRPC_HEADER.pack(int(compressed), len(payload)) + payload
+    return encode_varint(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Splits chunks of the stream to frames"""
+
+    def __init__(self, framing: str):
+        if framing not in FRAMINGS:
+            raise ValueError(f'Unknown stream framing {framing!r}')
+        self.framing = framing
+        self._buffer = bytearray()
+
+    def pending(self) -> bytes:
+        """Returns bytes of the incomplete frame"""
+        return bytes(self._buffer)
+
+    def feed(self, chunk: bytes) -> list:
+        """Returns complete frames as (payload, is compressed) tuples"""
+
+        buffer = self._buffer
+        buffer += chunk
+        frames = []
+        position = 0
+        while True:
+            if self.framing == GRPC:
+                if len(buffer) - position < _GRPC_HEADER.size:
+                    break
+                compressed, length = _GRPC_HEADER.unpack_from(buffer, position)
+                start = position + _GRPC_HEADER.size
+            else:
+                compressed = 0
+                length, start = _read_varint(buffer, position)
+                if length is None:
+                    break
+            end = start + length
+            if end > len(buffer):
+                break
+            frames.append((bytes(buffer[start:end]), bool(compressed)))
+            position = end
+        del buffer[:position]
+        return frames
+
+
+class FrameStream:
+    """Stream modifier for flow.response.stream. It passes each frame
+    payload through on_frame(payload) which returns the new payload.
+    Both mitmproxy stream interfaces are supported: a function of all
+    chunks returning a generator, and a function called for each chunk
+    and then with b'' at the end"""
+
+    def __init__(self, framing: str, on_frame, grpc_encoding: str = None):
+        self.framing = framing
+        self.decoder = FrameDecoder(framing)  # None for a broken stream
+        self.on_frame = on_frame
+        self.grpc_encoding = grpc_encoding
+        self.errors = []
+        self.frames = 0
+
+    def __call__(self, data):
+        if isinstance(data, (bytes, bytearray)):
+            return self.process(data) if data else self.finish()
+        return self._generate(data)
+
+    def _generate(self, chunks):
+        for chunk in chunks:
+            yield self.process(chunk)
+        yield self.finish()
+
+    def process(self, chunk: bytes) -> bytes:
+        """Returns processed frames which are complete after the chunk"""
+
+        if self.decoder is None:
+            return chunk
+        try:
+            frames = self.decoder.feed(chunk)
+        except ValueError as e:  # Broken stream is passed as is
+            self.errors.append(f'{e}. The rest of the stream is passed as is')
+            rest = self.decoder.pending()
+            self.decoder = None
+            return rest
+        return b''.join(self._process_frame(payload, compressed)
+                        for payload, compressed in frames)
+
+    def finish(self) -> bytes:
+        """Returns the rest of the stream which is not a complete frame"""
+
+        if self.decoder is None:
+            return b''
+        pending = self.decoder.pending()
+        if pending:
+            self.errors.append(f'Stream ends with {len(pending)} bytes of incomplete frame')
+        return pending
+
+    def _process_frame(self, payload: bytes, compressed: bool) -> bytes:
+        framing = self.framing
+        original = encode_frame(framing, payload, compressed)
+        self.frames += 1
+        if compressed and self.grpc_encoding != 'gzip':
+            self.errors.append(f'Frame compressed by {self.grpc_encoding} is passed as is')
+            return original
+        try:
+            if compressed:
+                payload = gzip.decompress(payload)
+            new_payload = self.on_frame(payload)
+        except Exception as e:
+            self.errors.append(f'Frame #{self.frames}: {e}')
+            return original
+        if new_payload is None:
+            return original
+        return encode_frame(framing, new_payload)
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+import capture_writer
+
+
+@pytest.mark.parametrize('fsync', capture_writer.FSYNC_POLICIES)
+def test_thread_survives_bad_capture(tmp_path, fsync):
+    writer = capture_writer.CaptureWriter(16, 'block', fsync)
+    try:
+        writer.save(str(tmp_path / 'a.json'), 'bad \ud800')  # Not encodable
+        writer.save(str(tmp_path / 'a.json'), '{"name": "книга ✓"}')
+        writer.flush()
+        assert writer.is_alive()
+        assert len(writer.pop_errors()) == 1
+    finally:
+        writer.close()
+    with open(tmp_path / 'a2.json', encoding='utf-8') as capture:
+        assert capture.read() == '{"name": "книга ✓"}'
+
+
+def test_sidecars_share_counter(tmp_path):
+    writer = capture_writer.CaptureWriter(16, 'block', 'never')
+    template = str(tmp_path / 'item.json')
+    try:
+        for _ in range(2):
+            writer.save(capture_writer.raw_path(template), b'\x08\x01',
+                        sidecars=((capture_writer.META_EXTENSION, '{}'),),
+                        extensions=(capture_writer.JSON_EXTENSION,))
+    finally:
+        writer.close()
+    assert sorted(os.listdir(tmp_path)) == ['item1.pb', 'item1.pb.meta',
+                                            'item2.pb', 'item2.pb.meta']
@@ -0,0 +1,147 @@
+import itertools
+
+import pytest
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+import classifier
+
+FIELD = descriptor_pb2.FieldDescriptorProto
+_files = itertools.count()
+
+
+def message_class(descriptor):
+    if hasattr(message_factory, 'GetMessageClass'):
+        return message_factory.GetMessageClass(descriptor)
+    return message_factory.MessageFactory().GetPrototype(descriptor)  # protobuf 3
+
+
+def make_types(messages: dict, syntax: str = 'proto2') -> dict:
+    """Builds message classes from {name: [(field name, number, type, label,
+    packed, group type name)..]} in a new descriptor pool"""
+
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name=f'classifier_test_{next(_files)}.proto', package='test', syntax=syntax)
+    for name, fields in messages.items():
+        message_proto = file_proto.message_type.add(name=name)
+        for field_name, number, field_type, label, packed, group in fields:
+            field = message_proto.field.add(name=field_name, number=number,
+                                            type=field_type, label=label)
+            if packed:
+                field.options.packed = True
+            if group:
+                message_proto.nested_type.add(name=group).field.add(
+                    name='value', number=1, type=FIELD.TYPE_INT32,
+                    label=FIELD.LABEL_OPTIONAL)
+                field.type_name = f'.test.{name}.{group}'
+    pool = descriptor_pool.DescriptorPool()
+    pool.AddSerializedFile(file_proto.SerializeToString())
+    file_descriptor = pool.FindFileByName(file_proto.name)
+    return {name: message_class(file_descriptor.message_types_by_name[name])
+            for name in messages}
+
+
+def field(name, number, field_type=FIELD.TYPE_INT32, label=FIELD.LABEL_OPTIONAL,
+          packed=False, group=None):
+    return name, number, field_type, label, packed, group
+
+
+TYPES = make_types({
+    'Numbers': [field('values', 1, label=FIELD.LABEL_REPEATED, packed=True)],
+    'Loose': [field('values', 1, label=FIELD.LABEL_REPEATED)],
+    'Search': [field('query', 1, FIELD.TYPE_STRING),
+               field('result', 2, FIELD.TYPE_GROUP, FIELD.LABEL_REPEATED,
+                     group='Result')],
+    'Named': [field('name', 1, FIELD.TYPE_STRING)],
+    'Alias': [field('name', 1, FIELD.TYPE_STRING)],
+    'Wide': [field('name', 1, FIELD.TYPE_STRING), field('id', 2),
+             field('size', 3), field('flag', 4, FIELD.TYPE_BOOL)],
+    'Strict': [field('name', 1, FIELD.TYPE_STRING),
+               field('id', 2, label=FIELD.LABEL_REQUIRED)],
+})
+
+
+def loaded_classifier():
+    types_classifier = classifier.Classifier(lambda: list(TYPES.values()))
+    types_classifier.load()
+    return types_classifier
+
+
+def test_packed_repeated_field():
+    content = TYPES['Numbers'](values=[1, 300, 5]).SerializeToString()
+    assert classifier.scan_tags(content) == {(1, classifier.LENGTH_DELIMITED)}
+    # Both forms of a repeated scalar are accepted by the signature
+    unpacked = TYPES['Loose'](values=[1, 2]).SerializeToString()
+    assert classifier.scan_tags(unpacked) == {(1, classifier.VARINT)}
+    types_classifier = classifier.Classifier(list)
+    for body in (content, unpacked):
+        assert types_classifier.classify(body, [TYPES['Numbers']]) is TYPES['Numbers']
+
+
+def test_group_is_one_top_level_tag():
+    search = TYPES['Search'](query='q')
+    search.result.add(value=7)
+    search.result.add(value=8)
+    content = search.SerializeToString()
+    # Fields inside the group are skipped
+    assert classifier.scan_tags(content) == {(1, classifier.LENGTH_DELIMITED),
+                                             (2, classifier.START_GROUP)}
+    assert loaded_classifier().classify(content) is TYPES['Search']
+
+
+@pytest.mark.parametrize('content', [
+    b'\x08',  # Key without value
+    b'\x08\xff',  # Truncated varint
+    b'\x0a\x05ab',  # Length is beyond the body
+    b'\x09\x01\x02',  # Truncated fixed64
+    b'\x00\x01',  # Field number 0
+    b'\x0f\x01',  # Wire type 7
+    b'\x13\x08\x01',  # Group is not closed
+    b'\x08' + b'\xff' * 10 + b'\x01',  # Varint is too long
+    b'Hello, world',
+])
+def test_broken_body_is_not_a_message(content):
+    assert classifier.scan_tags(content) is None
+    assert loaded_classifier().rank(content) == []
+    assert loaded_classifier().rank(content, list(TYPES.values())) == []
+
+
+def test_empty_body_fits_nothing():
+    assert loaded_classifier().rank(b'') == []
+
+
+def test_ties_keep_candidates_order():
+    content = TYPES['Named'](name='x').SerializeToString()
+    types_classifier = classifier.Classifier(list)
+    assert types_classifier.rank(content, [TYPES['Alias'], TYPES['Named']]) == \
+        [TYPES['Alias'], TYPES['Named']]
+    assert types_classifier.rank(content, [TYPES['Named'], TYPES['Alias']]) == \
+        [TYPES['Named'], TYPES['Alias']]
+
+
+def test_ties_among_all_types_by_full_name():
+    content = TYPES['Named'](name='x').SerializeToString()
+    ranked = loaded_classifier().rank(content, limit=10)
+    # A string looks like packed integers, so four types with one field tie.
+    # Wide has a quarter of its fields in the body
+    assert ranked[:4] == [TYPES['Alias'], TYPES['Loose'], TYPES['Named'],
+                          TYPES['Numbers']]
+    assert ranked.index(TYPES['Wide']) > 3
+
+
+def test_missing_required_field_excludes_type():
+    content = TYPES['Wide'](name='x').SerializeToString()
+    assert TYPES['Strict'] not in loaded_classifier().rank(content, limit=10)
+    content = TYPES['Wide'](name='x', id=1).SerializeToString()
+    assert loaded_classifier().classify(content) is TYPES['Strict']
+
+
+def test_all_types_are_searched_after_load():
+    content = TYPES['Wide'](name='x', id=1, size=2).SerializeToString()
+    loads = []
+    types_classifier = classifier.Classifier(lambda: loads.append(1) or list(TYPES.values()))
+    assert types_classifier.classify(content) is None  # Not loaded yet
+    assert not loads
+    types_classifier.load()
+    assert types_classifier.is_loaded
+    assert types_classifier.classify(content) is TYPES['Wide']
+    assert loads == [1]
@@ -0,0 +1,43 @@
+import json
+import sys
+
+import pytest
+
+import capture_writer
+import convert_captures
+
+helper = pytest.importorskip('helper', reason='proto_py is installed by setup.sh')
+
+
+def write_capture(directory, name, msg):
+    stem = str(directory / name)
+    with open(stem + capture_writer.RAW_EXTENSION, 'wb') as raw_file:
+        raw_file.write(msg.SerializeToString())
+    with open(stem + capture_writer.META_EXTENSION, 'w') as meta_file:
+        meta_file.write(capture_writer.meta_json(type(msg), 'http://host/a', 200))
+    return stem
+
+
+def test_round_trip(tmp_path, monkeypatch):
+    item_class = helper.registry.find('Item')
+    if item_class is None:
+        pytest.skip('Example message Item is not in proto_py')
+    (tmp_path / 'sub').mkdir()
+    stems = [write_capture(tmp_path, 'item1', item_class(id=1, type='книга')),
+             write_capture(tmp_path / 'sub', 'item2', item_class(id=2, type='', isActive=True))]
+    with open(tmp_path / 'broken.pb.meta', 'w') as meta_file:
+        json.dump({'message': 'no.Such'}, meta_file)
+    (tmp_path / 'broken.pb').write_bytes(b'')
+
+    monkeypatch.setattr(sys, 'argv', ['convert_captures.py', str(tmp_path),
+                                      '--workers', '1', '--delete'])
+    with pytest.raises(SystemExit) as exit_info:
+        convert_captures.main()
+    assert exit_info.value.code == 1  # The broken capture is reported
+
+    for stem, expected in zip(stems, [{'id': 1, 'type': 'книга'},
+                                      {'id': 2, 'type': '', 'isActive': True}]):
+        with open(stem + capture_writer.JSON_EXTENSION, encoding='utf-8') as json_file:
+            assert json.load(json_file) == expected
+    assert sorted(path.name for path in tmp_path.iterdir()) == \
+        ['broken.pb', 'broken.pb.meta', 'item1.json', 'sub']
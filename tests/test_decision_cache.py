@@ -0,0 +1,57 @@
+import decision_cache
+
+KEY = ('host', '/a', 'GET')
+
+
+def test_hit_and_miss_counters():
+    cache = decision_cache.DecisionCache(8)
+    assert cache.get(1, KEY) is None
+    decision = [{'path_expr': '/a'}, decision_cache.UNRESOLVED]
+    cache.put(1, KEY, decision)
+    assert cache.get(1, KEY) is decision
+    assert cache.get(1, KEY) is decision
+    assert cache.stats() == {'size': 1, 'max_size': 8, 'hits': 2, 'misses': 1,
+                             'hit_rate': 2 / 3}
+
+
+def test_empty_stats():
+    assert decision_cache.DecisionCache(8).stats()['hit_rate'] == 0.0
+
+
+def test_no_rule_is_cached():
+    cache = decision_cache.DecisionCache(8)
+    cache.get(1, KEY)
+    cache.put(1, KEY, [None, None])
+    assert cache.get(1, KEY) == [None, None]
+    assert cache.hits == 1
+
+
+def test_new_version_clears_decisions():
+    cache = decision_cache.DecisionCache(8)
+    cache.get(1, KEY)
+    cache.put(1, KEY, [None, None])
+    assert cache.get(2, KEY) is None
+    assert len(cache) == 0 and cache.version == 2
+
+
+def test_old_version_is_not_cached():
+    cache = decision_cache.DecisionCache(8)
+    cache.get(2, KEY)
+    # A flow which started before the reload
+    assert cache.get(1, KEY) is None
+    cache.put(1, KEY, [None, None])
+    assert len(cache) == 0
+    assert cache.version == 2
+
+
+def test_least_recently_used_is_evicted():
+    cache = decision_cache.DecisionCache(2)
+    for path in ('/a', '/b'):
+        cache.get(1, ('host', path, 'GET'))
+        cache.put(1, ('host', path, 'GET'), [path, None])
+    cache.get(1, ('host', '/a', 'GET'))  # /b is the oldest now
+    cache.put(1, ('host', '/c', 'GET'), ['/c', None])
+    assert len(cache) == 2
+    assert cache.get(1, ('host', '/b', 'GET')) is None
+    assert cache.get(1, ('host', '/a', 'GET')) == ['/a', None]
+    assert cache.get(1, ('host', '/c', 'GET')) == ['/c', None]
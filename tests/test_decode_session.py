@@ -0,0 +1,71 @@
+import json
+import sys
+
+import pytest
+
+helper = pytest.importorskip('helper', reason='proto_py is installed by setup.sh')
+
+from mitmproxy import io as mitmproxy_io  # noqa: E402
+from mitmproxy.test import tflow  # noqa: E402
+
+import decode_session  # noqa: E402
+
+
+def example_class(name):
+    protobuf_msg_type = helper.registry.find(name)
+    if protobuf_msg_type is None:
+        pytest.skip(f'Example message {name} is not in proto_py')
+    return protobuf_msg_type
+
+
+def make_flow(path, status_code, content, content_encoding=None):
+    flow = tflow.tflow(resp=True)
+    flow.request.host = 'example.com'
+    flow.request.path = path
+    flow.response.status_code = status_code
+    if content_encoding:
+        flow.response.headers['content-encoding'] = content_encoding
+    flow.response.content = content
+    return flow
+
+
+@pytest.mark.parametrize('output_format', ['ndjson', 'json'])
+def test_round_trip(tmp_path, monkeypatch, output_format):
+    item, error = example_class('Item'), example_class('Error')
+    api_rules = tmp_path / 'api_rules'
+    api_rules.mkdir()
+    # Item is the first error type, but only Error has a string field 3
+    with open(api_rules / 'example.json', 'w') as api_file:
+        json.dump({'server': ['example\\.com'],
+                   'errors': [{'proto_message': 'Item'}, {'proto_message': 'Error'}],
+                   'rules': [{'path': '/item', 'proto_message': 'Item'},
+                             {'path': '/text', 'proto_message': 'text'}]}, api_file)
+    flows = [make_flow('/item', 200, item(id=1, type='книга').SerializeToString(), 'gzip'),
+             make_flow('/other', 200, b'not mapped'),
+             make_flow('/item', 404, error(code=404, status='Not Found', description='x').SerializeToString()),
+             make_flow('/text', 200, 'привет'.encode())]
+    with open(tmp_path / 'session', 'wb') as dump_file:
+        writer = mitmproxy_io.FlowWriter(dump_file)
+        for flow in flows:
+            writer.add(flow)
+
+    output = tmp_path / 'out'
+    monkeypatch.setattr(sys, 'argv', [
+        'decode_session.py', str(tmp_path / 'session'), '-o', str(output),
+        '--format', output_format, '--api-rules', str(api_rules),
+        '--workers', '1', '--batch', '2', '--in-flight', '1'])
+    with pytest.raises(SystemExit) as exit_info:
+        decode_session.main()
+    assert exit_info.value.code == 0
+
+    with open(output, encoding='utf-8') as output_file:
+        if output_format == 'json':
+            records = json.load(output_file)
+        else:
+            records = [json.loads(line) for line in output_file]
+    assert [(record['flow'], record['status_code'], record['message'], record['body'])
+            for record in records] == [
+        (1, 200, 'messages.Item', {'id': 1, 'type': 'книга'}),
+        (3, 404, error.DESCRIPTOR.full_name, {'code': 404, 'status': 'Not Found', 'description': 'x'}),
+        (4, 200, 'text', 'привет'),
+    ]
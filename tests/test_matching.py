@@ -0,0 +1,174 @@
+import random
+import re
+
+import pytest
+
+import matching
+
+
+def linear_rule(rules, authority, path, method):
+    """The first config rule as find_rule scanned them before the index"""
+
+    for rule in rules:
+        methods = rule.get('method', matching.DEFAULT_METHODS)
+        if isinstance(methods, str):
+            methods = [methods]
+        if (rule.get('is_on', True) and
+                re.match(rule.get('authority_expr', '.*'), authority) and
+                re.match('^/*' + rule.get('path_expr', '.*') + '$', path) and
+                method in methods):
+            return rule
+    return None
+
+
+def linear_api(api_map, authority, path, method):
+    """The first API rule as find_api scanned them before the index"""
+
+    for api, _ in api_map:
+        if not any(re.match(server, authority) for server in api.get('server') or []):
+            continue
+        for rule in api.get('rules') or []:
+            if (re.match('^/*' + rule.get('path', '.*') + '$', path) and
+                    re.match(rule.get('method', '.*'), method)):
+                return rule
+    return None
+
+
+@pytest.mark.parametrize('pattern, prefix', [
+    ('/api/items', '/api/items'),
+    ('^/api/v1/.*', '/api/v1/'),
+    ('/api/item?', '/api/ite'),
+    ('/api/(a|b)', ''),  # Any alternation gives no prefix
+    ('/a|/b', ''),
+    ('api\\.example\\.com', 'api.example.com'),
+    ('/items/\\d+', '/items/'),
+    ('/x{2}', '/'),
+    ('.*', ''),
+])
+def test_literal_prefix(pattern, prefix):
+    assert matching.literal_prefix(pattern) == prefix
+    assert all(string.startswith(prefix) for string in ('/api/items', '/api/v1/x')
+               if re.match(pattern, string))
+
+
+RULES = [
+    {'authority_expr': 'api\\.example\\.com', 'path_expr': '/items', 'method': ['GET']},
+    {'authority_expr': 'api\\.example\\.com', 'path_expr': '/items', 'method': 'POST'},
+    {'path_expr': '/items/\\d+'},
+    {'authority_expr': '(api|cdn)\\.example\\.com', 'path_expr': '/(a|b)/.*'},
+    {'path_expr': '^/+deep/path'},
+    {'path_expr': '/deep/pat?h', 'is_on': False},
+    {'authority_expr': '.*example.*', 'path_expr': '/deep/.*', 'method': ['PATCH']},
+    {'authority_expr': 'cdn', 'path_expr': '.*'},
+]
+
+
+@pytest.mark.parametrize('authority, path, method', [
+    ('api.example.com', '/items', 'GET'),
+    ('api.example.com', '/items', 'POST'),
+    ('api.example.com', '/items', 'PUT'),
+    ('other.com', '/items/12', 'DELETE'),
+    ('other.com', '//items/12', 'GET'),
+    ('other.com', '/items/x', 'GET'),
+    ('cdn.example.com', '/b/c', 'GET'),
+    ('api.example.com', '/a/', 'PUT'),
+    ('host', '/deep/path', 'GET'),
+    ('host', '/deep/pah', 'GET'),
+    ('x.example.org', '/deep/pah', 'PATCH'),
+    ('cdn.other.com', '/anything', 'POST'),
+    ('cdn.other.com', '/anything', 'OPTIONS'),
+    ('', '/', 'GET'),
+])
+def test_rule_matcher_cases(authority, path, method):
+    matcher = matching.RuleMatcher(RULES)
+    assert matcher.match(authority, path, method) is \
+        linear_rule(RULES, authority, path, method)
+
+
+AUTHORITIES = ['api.example.com', 'cdn.example.com', 'example.org', 'a.b', '']
+PATH_PARTS = ['api', 'v1', 'items', '12', 'a', 'b', 'x.y']
+METHODS = ['GET', 'POST', 'PUT', 'DELETE', 'PATCH']
+
+
+def random_expr(randomizer, parts):
+    expr = randomizer.choice(['', '/', '^/', '^', '/+'])
+    for _ in range(randomizer.randint(0, 3)):
+        part = re.escape(randomizer.choice(parts))
+        expr += randomizer.choice([part, part + '/', f'({part}|{randomizer.choice(parts)})/',
+                                   part + '?', '.*', '\\d+', '[a-z]+/', part + '*'])
+    return expr
+
+
+def random_rule(randomizer):
+    rule = {'path_expr': random_expr(randomizer, PATH_PARTS)}
+    if randomizer.random() < 0.7:
+        rule['authority_expr'] = randomizer.choice(
+            ['api\\.example\\.com', '(api|cdn)\\.', '.*example', 'a', '', '^cdn', 'examp?le'])
+    if randomizer.random() < 0.5:
+        rule['method'] = randomizer.sample(METHODS, randomizer.randint(1, 3))
+    elif randomizer.random() < 0.3:
+        rule['method'] = randomizer.choice(METHODS)
+    if randomizer.random() < 0.2:
+        rule['is_on'] = False
+    return rule
+
+
+def random_path(randomizer):
+    return '/' * randomizer.randint(0, 2) + '/'.join(
+        randomizer.choice(PATH_PARTS) for _ in range(randomizer.randint(0, 3)))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_rule_matcher_fuzz(seed):
+    randomizer = random.Random(seed)
+    rules = [random_rule(randomizer) for _ in range(60)]
+    matcher = matching.RuleMatcher(rules)
+    assert not matcher.errors
+    for _ in range(300):
+        request = (randomizer.choice(AUTHORITIES), random_path(randomizer),
+                   randomizer.choice(METHODS))
+        assert matcher.match(*request) is linear_rule(rules, *request), request
+
+
+def test_rule_matcher_reports_invalid_rules():
+    matcher = matching.RuleMatcher([{'path_expr': '/('}, {'path_expr': '/ok'}])
+    assert len(matcher.errors) == 1
+    assert matcher.match('host', '/ok', 'GET') is not None
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_api_index_fuzz(seed):
+    randomizer = random.Random(seed)
+    api_map = []
+    for number in range(8):
+        servers = randomizer.sample(['api\\.example\\.com', '(api|cdn)\\.', '.*example',
+                                     'a', '^cdn', 'examp?le'], randomizer.randint(1, 2))
+        rules = []
+        for _ in range(10):
+            rule = {'path': random_expr(randomizer, PATH_PARTS)}
+            if randomizer.random() < 0.6:
+                rule['method'] = randomizer.choice(METHODS + ['GET|POST', 'P.*'])
+            rules.append(rule)
+        api_map.append(({'server': servers, 'rules': rules}, f'{number}.json'))
+
+    index = matching.ApiIndex(api_map, lambda rule: None)
+    assert not index.errors
+    for _ in range(300):
+        request = (randomizer.choice(AUTHORITIES), random_path(randomizer),
+                   randomizer.choice(METHODS))
+        entry = index.match(*request)
+        expected = linear_api(api_map, *request)
+        assert (entry.rule if entry else None) == expected, request
+
+
+def test_api_index_reuses_unchanged_files():
+    api = {'server': ['host'], 'rules': [{'path': '/a', 'proto_message': 'Item'}]}
+    resolved = []
+
+    def resolve(rule):
+        resolved.append(rule)
+        return None
+
+    first = matching.ApiIndex([(api, 'a.json')], resolve)
+    matching.ApiIndex([(api, 'a.json'), (dict(api), 'b.json')], resolve, previous=first)
+    assert len(resolved) == 2  # Only b.json is compiled again
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from google.protobuf import json_format
+
+import message_builder
+
+helper = pytest.importorskip('helper', reason='proto_py is installed by setup.sh')
+
+
+def example_class(name):
+    protobuf_msg_type = helper.registry.find(name)
+    if protobuf_msg_type is None:
+        pytest.skip(f'Example message {name} is not in proto_py')
+    return protobuf_msg_type
+
+
+def parse_bytes(protobuf_msg_type, json_obj) -> bytes:
+    """Bytes of the old pipeline: json string and json_format.Parse"""
+    return json_format.Parse(json.dumps(json_obj), protobuf_msg_type()).SerializeToString()
+
+
+@pytest.mark.parametrize('name, json_obj', [
+    ('Item', {'id': 1, 'type': 'book'}),
+    ('Item', {'id': -7, 'type': 'книга', 'isActive': True}),
+    ('Item', {'id': '12', 'type': '', 'isActive': False}),
+    ('Items', {'items': [{'id': 1, 'type': 'a'}, {'id': 2, 'type': 'b', 'isActive': True}]}),
+    ('Items', {'items': []}),
+    ('Error', {'code': 404, 'status': 'Not Found'}),
+    ('Error', {'code': 500, 'status': 'Internal', 'description': 'Try later'}),
+])
+def test_bytes_match_json_format(name, json_obj):
+    protobuf_msg_type = example_class(name)
+    assert message_builder.serialize(json_obj, (protobuf_msg_type,)) == \
+        parse_bytes(protobuf_msg_type, json_obj)
+
+
+def test_first_accepting_type_is_used():
+    item, error = example_class('Item'), example_class('Error')
+    json_obj = {'code': 1, 'status': 'ok'}
+    assert message_builder.serialize(json_obj, (item, error)) == parse_bytes(error, json_obj)
+
+
+def test_missing_required_field():
+    with pytest.raises(message_builder.BuildError) as error:
+        message_builder.serialize({'id': 1}, (example_class('Item'),))
+    assert error.value.path == 'type'
+
+
+@pytest.mark.parametrize('json_obj, path', [
+    ({'items': [{'id': 1, 'type': 'a'}, {'id': 'x', 'type': 'b'}]}, 'items[1].id'),
+    ({'items': [{'id': 1, 'type': 'a', 'color': 'red'}]}, 'items[0].color'),
+    ({'items': [{'id': 2 ** 31, 'type': 'a'}]}, 'items[0].id'),
+    ({'items': {'id': 1}}, 'items'),
+])
+def test_error_path(json_obj, path):
+    with pytest.raises(message_builder.BuildError) as error:
+        message_builder.serialize(json_obj, (example_class('Items'),))
+    assert error.value.path == path
+
+
+def test_field_labels():
+    items = example_class('Items').DESCRIPTOR
+    item = example_class('Item').DESCRIPTOR
+    assert message_builder.is_repeated(items.fields_by_name['items'])
+    assert not message_builder.is_repeated(item.fields_by_name['id'])
+    assert message_builder.is_required(item.fields_by_name['id'])
+    assert not message_builder.is_required(item.fields_by_name['isActive'])
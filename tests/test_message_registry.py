@@ -0,0 +1,65 @@
+from google.protobuf import wrappers_pb2
+
+from message_registry import MessageRegistry
+
+StringValue, Int32Value = wrappers_pb2.StringValue, wrappers_pb2.Int32Value
+
+# Entries of manifest: [import name, name, module, full name]
+MANIFEST = [
+    ['proto_py.a.item_pb2', 'Item', 'item_pb2', 'a.Item'],
+    ['proto_py.b.item_pb2', 'Item', 'b_item_pb2', 'b.Item'],
+    ['proto_py.b.item_pb2', 'Error', 'b_item_pb2', 'b.Error'],
+]
+
+
+def lazy_registry():
+    """Registry of stand-in classes, which counts loads of entries"""
+
+    loaded = []
+    classes = {'a.Item': StringValue, 'b.Item': Int32Value, 'b.Error': wrappers_pb2.BoolValue}
+
+    def load_class(entry):
+        loaded.append(entry[3])
+        return classes[entry[3]]
+
+    return MessageRegistry(manifest=MANIFEST, loader=load_class), loaded
+
+
+def test_classes_are_indexed():
+    registry = MessageRegistry([StringValue, Int32Value, int, 'not a class'])
+    assert len(registry) == 2
+    assert registry.find('StringValue') is StringValue
+    assert registry.find('Int32Value', 'google.protobuf.wrappers_pb2') is Int32Value
+    assert registry.find('Int32Value', 'other_pb2') is None
+    assert registry.find('google.protobuf.Int32Value') is Int32Value
+    assert registry.find_by_full_name('google.protobuf.StringValue') is StringValue
+    assert registry.find('Missing') is None
+    assert registry.ambiguous == {}
+
+
+def test_ambiguous_short_name():
+    registry, _ = lazy_registry()
+    assert registry.ambiguous == {'Item': ['item_pb2', 'b_item_pb2']}
+    assert registry.find('Item') is StringValue  # The first found one
+    assert registry.find('Item', 'b_item_pb2') is Int32Value
+    assert registry.find('b.Item') is Int32Value  # Full name is not ambiguous
+    assert registry.find_by_full_name('a.Item') is StringValue
+
+
+def test_modules_are_loaded_on_demand_once():
+    registry, loaded = lazy_registry()
+    assert len(registry) == 3 and loaded == []
+    assert registry.find('Error') is wrappers_pb2.BoolValue
+    assert registry.find_by_full_name('b.Error') is wrappers_pb2.BoolValue
+    assert registry.find('Error', 'b_item_pb2') is wrappers_pb2.BoolValue
+    assert loaded == ['b.Error']
+    assert set(registry.classes()) == {StringValue, Int32Value, wrappers_pb2.BoolValue}
+    assert sorted(loaded) == ['a.Item', 'b.Error', 'b.Item']
+    registry.classes()
+    assert len(loaded) == 3
+
+
+def test_loaded_class_keeps_ambiguity_order():
+    registry, _ = lazy_registry()
+    assert registry.find('Item', 'b_item_pb2') is Int32Value
+    assert registry.find('Item') is StringValue
@@ -0,0 +1,47 @@
+import metrics
+
+
+def test_fold_keeps_counts_and_forgets_rules():
+    collected = metrics.Metrics()
+    rule = {'path_expr': '/a', 'method': 'GET'}
+    for _ in range(3):
+        collected.hit_rule(rule)
+    collected.fold()
+    reloaded_rule = dict(rule)  # Every new config version has new dicts
+    collected.hit_rule(reloaded_rule)
+    collected.fold()
+    assert collected.to_dict()['rule_hits'] == {'*/a GET': 4}
+    assert not collected._rule_hits
+
+
+def test_rule_labels():
+    collected = metrics.Metrics()
+    collected.hit_rule({'authority_expr': 'host', 'path_expr': '/a', 'method': ['GET', 'POST']})
+    collected.hit_rule({'path_expr': '/b'})
+    assert collected.to_dict()['rule_hits'] == {'host/a GET,POST': 1, '*/b *': 1}
+
+
+def test_disabled_metrics_record_nothing():
+    collected = metrics.Metrics(enabled=False)
+    collected.hit_rule({'path_expr': '/a'})
+    collected.miss_rule()
+    collected.observe('match', collected.clock())
+    data = collected.to_dict()
+    assert data['rule_hits'] == {} and data['rule_misses'] == 0
+    assert data['latency_seconds']['match']['count'] == 0
+
+
+def test_prometheus_label_escapes():
+    collected = metrics.Metrics()
+    collected.hit_rule({'authority_expr': 'api\\.пример\\.рф', 'path_expr': '/a\tb"\nc'})
+    line = [line for line in collected.to_prometheus().splitlines()
+            if line.startswith('rewriter_rule_hits_total{')]
+    assert line == ['rewriter_rule_hits_total{rule="api\\\\.пример\\\\.рф/a\tb\\"\\nc *"} 1']
+
+
+def test_export_is_utf8(tmp_path):
+    collected = metrics.Metrics()
+    collected.hit_rule({'path_expr': '/пример'})
+    path = tmp_path / 'metrics.prom'
+    collected.export(str(path))
+    assert 'rule="*/пример *"' in path.read_bytes().decode('utf-8')
@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+import pytest
+from mitmproxy.test import tflow
+
+import network
+
+
+def test_rule_without_conditions():
+    assert network.Conditions.from_rule({}) is None
+    assert network.Conditions.from_rule({'delay': '', 'loss': None, 'bandwidth': 0}) is None
+
+
+def test_conditions_from_rule():
+    conditions = network.Conditions.from_rule({'delay': '1.5', 'jitter': 0.5, 'loss': 0.1,
+                                               'bandwidth': 1000})
+    assert conditions == network.Conditions(1.5, 0.5, 0.1, 1000.0)
+
+
+def test_transfer_time():
+    assert network.Conditions(0, 0, 0, 1000).transfer_time(2500) == 2.5
+    assert network.Conditions(1, 0, 0, 0).transfer_time(2500) == 0.0  # Unlimited
+
+
+def test_latency_with_jitter(monkeypatch):
+    monkeypatch.setattr(network, 'random', random.Random(1))
+    conditions = network.Conditions(1.0, 0.5, 0, 0)
+    latencies = [conditions.latency() for _ in range(200)]
+    assert all(0.5 <= latency <= 1.5 for latency in latencies)
+    assert min(latencies) < 0.7 and max(latencies) > 1.3
+    assert network.Conditions(0.1, 1.0, 0, 0).latency() >= 0  # Never negative
+    assert network.Conditions(2.0, 0, 0, 0).latency() == 2.0
+
+
+def test_loss():
+    assert not any(network.Conditions(0, 0, 0, 0).is_lost() for _ in range(100))
+    assert all(network.Conditions(0, 0, 1, 0).is_lost() for _ in range(100))
+
+
+def test_kill():
+    flow = tflow.tflow()
+    network.kill(flow)
+    assert flow.error is not None
+    network.kill(flow)  # Killed flow is not killable
+
+
+@pytest.fixture
+def run():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield lambda seconds: loop.run_until_complete(asyncio.sleep(seconds))
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_held_flow_is_resumed(run):
+    flow = tflow.tflow()
+    network.hold(flow, 0.01)
+    assert flow.intercepted and network.is_held(flow)
+    run(0.05)
+    assert not flow.intercepted and not network.is_held(flow)
+
+
+def test_flow_of_user_is_not_held(run):
+    flow = tflow.tflow()
+    flow.intercept()  # By the user
+    network.hold(flow, 0.01)
+    assert not network.intercept(flow)
+    run(0.05)
+    assert flow.intercepted and not network.is_held(flow)
+
+
+def test_flow_intercepted_again_by_user(run):
+    flow = tflow.tflow()
+    network.hold(flow, 0.01)
+    flow.resume()  # By the user, the timer is not fired yet
+    run(0.05)
+    assert not flow.intercepted
+    flow.intercept()  # By the user later
+    network.resume_later(flow, 0)
+    assert flow.intercepted
+
+
+def test_resume_now(run):
+    flow = tflow.tflow()
+    assert network.intercept(flow)
+    network.resume_later(flow, 0)
+    assert not flow.intercepted
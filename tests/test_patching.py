@@ -0,0 +1,125 @@
+import json
+import os
+
+import pytest
+from google.protobuf import api_pb2, source_context_pb2
+
+import patching
+import payload_cache
+
+Api, Method = api_pb2.Api, api_pb2.Method
+
+
+def upstream() -> bytes:
+    api = Api(name='api', version='v1',
+              methods=[Method(name='get', request_streaming=True, response_type_url='r')],
+              source_context=source_context_pb2.SourceContext(file_name='api.proto'))
+    return api.SerializeToString()
+
+
+def apply_both(patch_json: dict) -> tuple:
+    """Results of merge and wire modes, decoded"""
+
+    patch = patching.compile_patch(Api, patch_json)
+    merged = Api.FromString(patching.apply_merge(Api, upstream(), patch))
+    appended = Api.FromString(patching.apply_wire(upstream(), patch))
+    return merged, appended
+
+
+def test_expand_fields():
+    assert patching.expand_fields({'a.b.c': 1, 'a.d': 2, 'e': 3}) == \
+        {'a': {'b': {'c': 1}, 'd': 2}, 'e': 3}
+    with pytest.raises(ValueError):
+        patching.expand_fields({'a': 1, 'a.b': 2})
+
+
+def test_merge_json():
+    base = {'a': {'b': 1, 'c': 2}, 'd': [1], 'e': 'x'}
+    assert patching.merge_json(base, {'a': {'c': 3}, 'd': [2], 'f': None}) == \
+        {'a': {'b': 1, 'c': 3}, 'd': [2], 'e': 'x', 'f': None}
+    assert base['a'] == {'b': 1, 'c': 2}  # Base is not changed
+
+
+def test_merge_and_wire_give_same_message():
+    merged, appended = apply_both({'version': 'v2', 'sourceContext': {'fileName': 'b'}})
+    assert merged == appended
+    assert merged.version == 'v2'
+    assert merged.source_context.file_name == 'b'
+    assert merged.name == 'api'  # Fields out of the patch are kept
+
+
+def test_default_values_replace_upstream_ones():
+    patch = patching.compile_patch(Method, {'requestStreaming': False, 'name': ''})
+    assert patch != b''
+    content = Method(name='get', request_streaming=True, response_type_url='r').SerializeToString()
+    for result in (patching.apply_merge(Method, content, patch),
+                   patching.apply_wire(content, patch)):
+        assert Method.FromString(result) == Method(response_type_url='r')
+
+
+def test_default_values_of_nested_messages():
+    merged, appended = apply_both({'version': '', 'sourceContext': {'file_name': ''}})
+    assert merged == appended
+    assert merged.version == ''
+    assert merged.source_context.file_name == ''
+    assert merged.HasField('source_context')
+
+
+def test_repeated_fields_are_appended():
+    merged, appended = apply_both({'methods': [{'name': 'put', 'requestStreaming': False}]})
+    assert merged == appended
+    assert [method.name for method in merged.methods] == ['get', 'put']
+    assert merged.methods[0].request_streaming  # Upstream item is not changed
+
+
+class TestPatches:
+
+    @pytest.fixture
+    def patch_file(self, tmp_path):
+        path = str(tmp_path / 'patch.json')
+        self.write(path, {'version': 'v2'})
+        return path
+
+    @staticmethod
+    def write(path, json_obj, mtime_step=0):
+        with open(path, 'w') as patch_file:
+            json.dump(json_obj, patch_file)
+        if mtime_step:
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_step))
+
+    @staticmethod
+    def decoded(patch: bytes) -> Api:
+        return Api.FromString(patching.apply_merge(Api, b'', patch))
+
+    def test_fields_override_file(self, patch_file):
+        patches = patching.Patches(payload_cache.PayloadCache(1024, check_interval=0))
+        rule = {'patch_content': 'patch.json', 'patch_fields': {'version': 'v3',
+                                                                'sourceContext.fileName': 'f'}}
+        patch = self.decoded(patches.get(rule, patch_file, Api))
+        assert (patch.version, patch.source_context.file_name) == ('v3', 'f')
+
+    def test_compiled_once(self, patch_file):
+        patches = patching.Patches(payload_cache.PayloadCache(1024, check_interval=0))
+        rule = {'patch_content': 'patch.json'}
+        patch = patches.get(rule, patch_file, Api)
+        assert patches.get(rule, patch_file, Api) is patch
+
+    def test_file_change_compiles_again(self, patch_file):
+        patches = patching.Patches(payload_cache.PayloadCache(1024, check_interval=0))
+        rule = {'patch_content': 'patch.json'}
+        assert self.decoded(patches.get(rule, patch_file, Api)).version == 'v2'
+        self.write(patch_file, {'version': 'v9'}, mtime_step=10 ** 9)
+        assert self.decoded(patches.get(rule, patch_file, Api)).version == 'v9'
+
+    def test_new_rule_compiles_again(self):
+        patches = patching.Patches(payload_cache.PayloadCache(1024))
+        patch = patches.get({'patch_fields': {'name': 'a'}}, None, Api)
+        assert self.decoded(patch).name == 'a'
+        # Equal rule of a new config version is another dict
+        assert self.decoded(patches.get({'patch_fields': {'name': 'b'}}, None, Api)).name == 'b'
+
+    def test_invalid_patch(self):
+        patches = patching.Patches(payload_cache.PayloadCache(1024))
+        with pytest.raises(ValueError):
+            patches.get({'patch_fields': {'noSuchField': 1}}, None, Api)
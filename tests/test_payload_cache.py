@@ -0,0 +1,45 @@
+import os
+
+from google.protobuf import wrappers_pb2
+
+import payload_cache
+
+
+def write(path, text, mtime_step=0):
+    with open(path, 'w') as text_file:
+        text_file.write(text)
+    if mtime_step:
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_step))
+
+
+def test_changed_file_is_read_again(tmp_path):
+    path = str(tmp_path / 'fake.txt')
+    write(path, 'old')
+    cache = payload_cache.PayloadCache(1024, check_interval=0)
+    assert cache.get(path, payload_cache.TEXT_TYPES) == 'old'
+    write(path, 'new', mtime_step=10 ** 9)
+    assert cache.lookup(path, payload_cache.TEXT_TYPES) is None
+    assert cache.get(path, payload_cache.TEXT_TYPES) == 'new'
+
+
+def test_compressed_payload_follows_file(tmp_path):
+    path = str(tmp_path / 'fake.json')
+    msg_types = (wrappers_pb2.StringValue,)
+    write(path, '"old"')
+    cache = payload_cache.PayloadCache(1024, check_interval=0)
+    gzip = payload_cache.ENCODERS['gzip']
+    cache.get(path, msg_types, 'gzip')
+    write(path, '"new"', mtime_step=10 ** 9)
+    assert cache.get(path, msg_types, 'gzip') == \
+        gzip(wrappers_pb2.StringValue(value='new').SerializeToString())
+
+
+def test_size_is_bounded(tmp_path):
+    cache = payload_cache.PayloadCache(10, check_interval=0)
+    for name in 'abc':
+        path = str(tmp_path / name)
+        write(path, name * 4)
+        cache.get(path, payload_cache.TEXT_TYPES)
+    assert cache.size <= 10
+    assert cache.lookup(str(tmp_path / 'c'), payload_cache.TEXT_TYPES) == 'cccc'
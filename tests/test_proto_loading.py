@@ -0,0 +1,110 @@
+import importlib
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+from conftest import ROOT_DIR
+
+PACKAGE = 'proto_py_test'
+MODULE = PACKAGE + '.example.item_pb2'
+ENTRY = [MODULE, 'Item', MODULE, 'example.Item']
+
+SOURCE = '''from types import SimpleNamespace
+
+
+class Item:
+    DESCRIPTOR = SimpleNamespace(full_name='example.Item')
+'''
+
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+    """proto_py made by setup.sh: init.py with a generated module"""
+
+    root = tmp_path / PACKAGE
+    (root / 'example').mkdir(parents=True)
+    shutil.copy(os.path.join(ROOT_DIR, 'init.py'), root / '__init__.py')
+    (root / 'example' / 'item_pb2.py').write_text(SOURCE)
+    monkeypatch.setattr(sys, 'path', [str(tmp_path)] + sys.path)
+    yield root
+    forget()
+
+
+def forget():
+    for name in list(sys.modules):
+        if name == PACKAGE or name.startswith(PACKAGE + '.'):
+            del sys.modules[name]
+
+
+def load(monkeypatch, loading):
+    """Imports the package as the addon does on start"""
+
+    forget()
+    monkeypatch.setenv('PROTO_PY_LOADING', loading)
+    importlib.invalidate_caches()
+    return importlib.import_module(PACKAGE)
+
+
+def touch(path, mtime_step=10 ** 9):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_step))
+
+
+def test_eager_imports_everything(package, monkeypatch):
+    proto_py = load(monkeypatch, 'eager')
+    assert proto_py.manifest is None
+    assert 'Item' in [cls.__name__ for cls in proto_py.clsmembers]
+    assert not (package / 'manifest.json').exists()
+
+
+def test_first_lazy_start_writes_manifest(package, monkeypatch):
+    proto_py = load(monkeypatch, 'lazy')
+    assert proto_py.manifest == [ENTRY]
+    with open(package / 'manifest.json') as manifest_file:
+        assert json.load(manifest_file)['messages'] == [ENTRY]
+
+
+def test_fresh_manifest_imports_nothing(package, monkeypatch):
+    load(monkeypatch, 'lazy')
+    proto_py = load(monkeypatch, 'lazy')
+    assert MODULE not in sys.modules
+    assert proto_py.manifest == [ENTRY] and proto_py.clsmembers == []
+    assert proto_py.load_class(ENTRY).__name__ == 'Item'
+
+
+def test_changed_module_makes_manifest_stale(package, monkeypatch):
+    load(monkeypatch, 'lazy')
+    (package / 'example' / 'item_pb2.py').write_text(
+        SOURCE + '\n\nclass Error:\n    DESCRIPTOR = SimpleNamespace(full_name=\'example.Error\')\n')
+    touch(package / 'example' / 'item_pb2.py')
+    proto_py = load(monkeypatch, 'lazy')
+    assert MODULE in sys.modules  # Scanned again
+    assert sorted(entry[1] for entry in proto_py.manifest) == ['Error', 'Item']
+    assert load(monkeypatch, 'lazy').manifest == proto_py.manifest
+
+
+def test_new_module_makes_manifest_stale(package, monkeypatch):
+    proto_py = load(monkeypatch, 'lazy')
+    files = proto_py.module_files()
+    (package / 'example' / 'other_pb2.py').write_text('')
+    assert proto_py.read_manifest(proto_py.module_files()) is None
+    assert proto_py.read_manifest(files) == [ENTRY]
+
+
+@pytest.mark.parametrize('content', ['{broken', '[]', '{"modules": {}}', 'null'])
+def test_bad_manifest_is_made_again(package, monkeypatch, content):
+    (package / 'manifest.json').write_text(content)
+    proto_py = load(monkeypatch, 'lazy')
+    assert proto_py.manifest == [ENTRY]
+    assert MODULE in sys.modules
+    with open(package / 'manifest.json') as manifest_file:
+        assert json.load(manifest_file)['messages'] == [ENTRY]
+
+
+def test_read_only_installation(package, monkeypatch):
+    (package / 'manifest.json').symlink_to(package / 'missing' / 'manifest.json')
+    proto_py = load(monkeypatch, 'lazy')
+    assert proto_py.manifest == [ENTRY]
@@ -0,0 +1,107 @@
+import json
+import threading
+
+import pytest
+
+import snapshot
+
+CONFIG = [{'path_expr': '/a'}, {'path_expr': '/b'}]
+API_MAP = [({'server': ['host'], 'rules': [{'path': '/a', 'proto_message': 'Item'}]}, 'a.json')]
+
+
+def resolve(rule):
+    return None
+
+
+def test_versions_and_unchanged_parts():
+    store = snapshot.SnapshotStore(CONFIG, API_MAP, resolve)
+    first = store.current
+    assert first.version == 1
+    assert first.config == tuple(CONFIG)
+
+    second = store.publish(config=[{'path_expr': '/c'}])
+    assert store.current is second and second.version == 2
+    assert second.rule_matcher is not first.rule_matcher
+    assert second.api_index is first.api_index  # API map is not changed
+
+    third = store.publish(api_map=[])
+    assert third.version == 3
+    assert third.rule_matcher is second.rule_matcher
+    assert third.api_map == ()
+
+
+def test_old_snapshot_is_not_changed():
+    store = snapshot.SnapshotStore(CONFIG, API_MAP, resolve)
+    old = store.current
+    store.publish(config=[{'path_expr': '/c'}], api_map=[])
+    # A flow which started with the old version still matches by it
+    assert old.config == tuple(CONFIG)
+    assert old.rule_matcher.match('host', '/a', 'GET') is old.config[0]
+    assert old.api_index.match('host', '/a', 'GET') is not None
+    assert store.current.rule_matcher.match('host', '/a', 'GET') is None
+
+
+def test_functions_get_current_parts():
+    store = snapshot.SnapshotStore(CONFIG, API_MAP, resolve)
+    store.publish(config=lambda config: config + ({'path_expr': '/c'},),
+                  api_map=lambda api_map: api_map[:0])
+    assert [rule['path_expr'] for rule in store.current.config] == ['/a', '/b', '/c']
+    assert store.current.api_map == ()
+
+
+def test_errors_of_version():
+    store = snapshot.SnapshotStore(CONFIG, API_MAP, resolve)
+    assert store.publish(config=[{'path_expr': '/('}]).errors
+    assert not store.publish(api_map=[]).errors  # Only new parts are compiled
+
+
+def test_concurrent_publishes_are_not_lost():
+    store = snapshot.SnapshotStore([], [], resolve)
+
+    def add_rules(number):
+        for index in range(50):
+            store.publish(config=lambda config: config + ({'path_expr': f'/{number}/{index}'},))
+
+    threads = [threading.Thread(target=add_rules, args=(number,)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(store.current.config) == 200
+    assert store.current.version == 201
+
+
+@pytest.fixture
+def rewriter(tmp_path):
+    pytest.importorskip('helper', reason='proto_py is installed by setup.sh')
+    from mitmproxy.test import taddons, tflow
+    import rewrite_core
+
+    (tmp_path / 'api').mkdir()
+    with open(tmp_path / 'config.json', 'w') as config_file:
+        json.dump([{'path_expr': '/a', 'status_code': 201}], config_file)
+    with taddons.context():
+        addon = rewrite_core.Rewriter(
+            str(tmp_path / 'config.json'), str(tmp_path), str(tmp_path),
+            str(tmp_path / 'api'), '', '', '', headless=True)
+        yield addon, tflow
+        addon.done()
+
+
+def test_flow_keeps_its_snapshot(rewriter):
+    addon, tflow = rewriter
+    flow = tflow.tflow(resp=True)
+    flow.request.path = '/a'
+    addon.request(flow)
+    old = addon.flow_snapshot(flow)
+
+    addon.store.publish(config=[{'path_expr': '/a', 'status_code': 500}])
+    assert addon.flow_snapshot(flow) is old  # Reloaded in flight
+    addon.response(flow)
+    assert flow.response.status_code == 201
+
+    new_flow = tflow.tflow(resp=True)
+    new_flow.request.path = '/a'
+    addon.request(new_flow)
+    addon.response(new_flow)
+    assert new_flow.response.status_code == 500
@@ -0,0 +1,45 @@
+import pytest
+
+import streaming
+
+PAYLOADS = [b'', b'\x08\x01', b'x' * 300, b'\x00' * 70000]
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('framing', streaming.FRAMINGS)
+@pytest.mark.parametrize('chunk_size', [1, 3, 1000, 10 ** 6])
+def test_frames_split_anywhere(framing, chunk_size):
+    stream = b''.join(streaming.encode_frame(framing, payload) for payload in PAYLOADS)
+    decoder = streaming.FrameDecoder(framing)
+    frames = []
+    for chunk in chunks(stream, chunk_size):
+        frames.extend(decoder.feed(chunk))
+    assert frames == [(payload, False) for payload in PAYLOADS]
+    assert decoder.pending() == b''
+
+
+def test_incomplete_frame_is_pending():
+    decoder = streaming.FrameDecoder(streaming.GRPC)
+    frame = streaming.encode_frame(streaming.GRPC, b'abc', compressed=True)
+    assert decoder.feed(frame + frame[:4]) == [(b'abc', True)]
+    assert decoder.pending() == frame[:4]
+    assert decoder.feed(frame[4:]) == [(b'abc', True)]
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63 - 1])
+def test_varint_lengths(value):
+    decoder = streaming.FrameDecoder(streaming.DELIMITED)
+    encoded = streaming.encode_varint(value)
+    assert decoder.feed(encoded) == ([(b'', False)] if value == 0 else [])
+    if value:
+        assert decoder.pending() == encoded
+
+
+def test_invalid_stream():
+    with pytest.raises(ValueError):
+        streaming.FrameDecoder('chunked')
+    with pytest.raises(ValueError):
+        streaming.FrameDecoder(streaming.DELIMITED).feed(b'\xff' * 11)
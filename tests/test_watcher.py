@@ -0,0 +1,99 @@
+import json
+import os
+
+import watcher
+
+
+def write_json(path, json_obj):
+    with open(path, 'w') as json_file:
+        json.dump(json_obj, json_file)
+
+
+def make_watcher(tmp_path, apis):
+    api_rules_dir = tmp_path / 'api_rules'
+    api_rules_dir.mkdir()
+    write_json(tmp_path / 'config.json', [{'path_expr': '/a'}])
+    for name, api in apis.items():
+        write_json(api_rules_dir / name, api)
+    config_watcher = watcher.ConfigWatcher(str(tmp_path / 'config.json'), str(api_rules_dir))
+    config_watcher.poll()
+    return config_watcher
+
+
+def touch(path, json_obj):
+    write_json(path, json_obj)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_merge_keeps_unsaved_edits(tmp_path):
+    config_watcher = make_watcher(tmp_path, {'example.json': {'server': ['a']},
+                                             'other.json': {'server': ['b']}})
+    api_map = [({'server': ['edited']} if name == 'example.json' else api, name)
+               for api, name in config_watcher.api_map]
+
+    touch(tmp_path / 'api_rules' / 'other.json', {'server': ['c']})
+    assert config_watcher.poll() == (False, True)
+    merged = dict((name, api) for api, name in watcher.merge_api_changes(
+        api_map, config_watcher.changed_apis, config_watcher.removed_apis))
+    assert merged == {'example.json': {'server': ['edited']}, 'other.json': {'server': ['c']}}
+
+
+def test_merge_adds_and_removes_files(tmp_path):
+    config_watcher = make_watcher(tmp_path, {'a.json': {'server': ['a']},
+                                             'b.json': {'server': ['b']}})
+    api_map = list(config_watcher.api_map)
+    os.unlink(tmp_path / 'api_rules' / 'a.json')
+    write_json(tmp_path / 'api_rules' / 'c.json', {'server': ['c']})
+    config_watcher.poll()
+    merged = watcher.merge_api_changes(
+        api_map, config_watcher.changed_apis, config_watcher.removed_apis)
+    assert [name for _, name in merged] == ['b.json', 'c.json']
+
+
+def mtimes(directory):
+    return {name: os.stat(os.path.join(directory, name)).st_mtime_ns
+            for name in os.listdir(directory)}
+
+
+def test_save_writes_only_changed_files(tmp_path):
+    config_watcher = make_watcher(tmp_path, {'a.json': {'server': ['a']},
+                                             'b.json': {'server': ['b']}})
+    api_rules_dir = str(tmp_path / 'api_rules')
+    before = mtimes(api_rules_dir)
+
+    assert config_watcher.save_api_map(config_watcher.api_map) == ([], [])
+    api_map = [({'server': ['edited']} if name == 'a.json' else api, name)
+               for api, name in config_watcher.api_map]
+    assert config_watcher.save_api_map(api_map) == (['a.json'], [])
+
+    after = mtimes(api_rules_dir)
+    assert sorted(after) == ['a.json', 'b.json']  # No temporary files are left
+    assert after['b.json'] == before['b.json']
+    with open(os.path.join(api_rules_dir, 'a.json')) as api_file:
+        assert json.load(api_file) == {'server': ['edited']}
+    assert config_watcher.poll() == (False, False)  # Own writes are not reloaded
+
+
+def test_save_removes_only_removed_files(tmp_path):
+    config_watcher = make_watcher(tmp_path, {'a.json': {}, 'b.json': {}})
+    write_json(tmp_path / 'api_rules' / 'unknown.json', {})
+    api_map = [(api, name) for api, name in config_watcher.api_map if name != 'a.json']
+    assert config_watcher.save_api_map(api_map) == ([], ['a.json'])
+    assert sorted(os.listdir(tmp_path / 'api_rules')) == ['b.json', 'unknown.json']
+
+
+def test_save_config_by_rule_identity(tmp_path):
+    config_watcher = make_watcher(tmp_path, {})
+    config = tuple(config_watcher.config)
+    assert not config_watcher.save_config(config)
+    assert config_watcher.save_config(config + ({'path_expr': '/b'},))
+    with open(tmp_path / 'config.json') as config_file:
+        assert json.load(config_file) == [{'path_expr': '/a'}, {'path_expr': '/b'}]
+    assert config_watcher.poll() == (False, False)
+
+
+def test_temporary_files_are_not_rules(tmp_path):
+    config_watcher = make_watcher(tmp_path, {'a.json': {}})
+    write_json(tmp_path / 'api_rules' / ('b.json' + watcher.TEMP_EXTENSION), {})
+    assert config_watcher.poll() == (False, False)
@@ -0,0 +1,211 @@
+"""
+Watcher of the config file and API rules files. Each poll stats the
+files and re-parses only changed ones. A file that cannot be read
+or decoded keeps its last good version. Saving writes only the files
+whose json objects are not the ones last loaded or saved, each of
+them atomically.
+"""
+
+import json
+import os
+
+TEMP_EXTENSION = '.tmp'
+
+
+def _signature(entry: os.DirEntry) -> tuple:
+    stat = entry.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _fsync_directory(directory: str) -> None:
+    """Makes renames in the directory durable. Not possible on Windows"""
+
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path: str, json_obj) -> None:
+    """Writes json to a temporary file, syncs it and renames it over
+    the path. The file is either old or new even after a crash"""
+
+    temp_path = path + TEMP_EXTENSION
+    try:
+        with open(temp_path, 'w') as json_file:
+            json.dump(json_obj, json_file, indent=4)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(os.path.dirname(path) or '.')
+
+
+def merge_api_changes(api_map, changed_apis: dict, removed_apis: set) -> list:
+    """Returns the API map with changed files of a poll replaced,
+    removed ones dropped and new ones added at the end. Other files
+    keep their versions from the map, so their unsaved edits are not lost"""
+
+    merged = []
+    names = set()
+    for api, name in api_map:
+        names.add(name)
+        if name in removed_apis:
+            continue
+        merged.append((changed_apis.get(name, api), name))
+    merged.extend((api, name) for name, api in changed_apis.items()
+                  if name not in names)
+    return merged
+
+
+class ConfigWatcher:
+    """Last good versions of config and API map
+    and signatures of files they are read from"""
+
+    def __init__(self, config_file_path: str, api_rules_dir: str):
+        self.config_file_path = config_file_path
+        self.api_rules_dir = api_rules_dir
+        self.config = None  # List of rules
+        self.api_map = []  # List of tuples [(json, string_file_name), ..]
+        self.errors = []  # Errors of the last poll
+        self.changed_apis = {}  # {file name: json} read by the last poll
+        self.removed_apis = set()  # File names removed since the last poll
+        self._signatures = {}
+        self._apis = {}  # {file name: json} in the order of api_map, as on disk
+
+    def poll(self, force: bool = False) -> tuple:
+        """Reads changed files or all files if force is set.
+        Returns (is config changed, is API map changed)"""
+
+        self.errors = []
+        self.changed_apis = {}
+        self.removed_apis = set()
+        if force:
+            self._signatures.clear()
+        return self._poll_config(), self.poll_api_map()
+
+    def _load(self, path: str, signature: tuple):
+        """Returns json of the file or None if it is unchanged or invalid"""
+
+        if self._signatures.get(path) == signature:
+            return None
+        self._signatures[path] = signature
+        try:
+            with open(path) as json_file:
+                return json.load(json_file)
+        except json.JSONDecodeError:
+            self.errors.append(f'Cannot decode json config in {path}, please check it.')
+        except EnvironmentError as e:
+            self.errors.append(f'Cannot read {path}: {e}')
+        return None
+
+    def _poll_config(self) -> bool:
+        try:
+            stat = os.stat(self.config_file_path)
+        except OSError:
+            if self._signatures.pop(self.config_file_path, None) is not None:
+                self.errors.append(f'File {self.config_file_path} is removed.'
+                                   f' The last loaded config is used.')
+            elif self.config is None:
+                self.errors.append(f'File {self.config_file_path} not found.'
+                                   f' It is needed to work with the addon.')
+            return False
+        config = self._load(self.config_file_path, (stat.st_mtime_ns, stat.st_size))
+        if config is None:
+            return False
+        self.config = config
+        return True
+
+    def poll_api_map(self) -> bool:
+        """Reads changed API files only. Returns whether API map is changed"""
+
+        changed = False
+        present = set()
+        try:
+            entries = [entry for entry in os.scandir(self.api_rules_dir)
+                       if entry.is_file() and not entry.name.endswith(TEMP_EXTENSION)]
+        except OSError as e:
+            self.errors.append(f'Cannot read {self.api_rules_dir}: {e}')
+            return False
+
+        for entry in entries:
+            present.add(entry.name)
+            try:
+                signature = _signature(entry)
+            except OSError:
+                continue  # Removed right now, it will be seen by the next poll
+            api = self._load(entry.path, signature)
+            if api is not None:
+                self._apis[entry.name] = api
+                self.changed_apis[entry.name] = api
+                changed = True
+
+        for name in list(self._apis):
+            if name not in present:
+                del self._apis[name]
+                self._signatures.pop(os.path.join(self.api_rules_dir, name), None)
+                self.removed_apis.add(name)
+                changed = True
+
+        if changed:
+            self.api_map = [(api, name) for name, api in self._apis.items()]
+        return changed
+
+    def _write(self, path: str, json_obj) -> None:
+        """Writes the file and remembers it, so the next poll skips it"""
+
+        atomic_write_json(path, json_obj)
+        stat = os.stat(path)
+        self._signatures[path] = (stat.st_mtime_ns, stat.st_size)
+
+    def save_config(self, config) -> bool:
+        """Writes config if any of its rules is not the one last loaded
+        or saved. Returns whether the file is written"""
+
+        config = list(config)
+        if self.config is not None and len(config) == len(self.config) and \
+                all(rule is old_rule for rule, old_rule in zip(config, self.config)):
+            return False
+        self._write(self.config_file_path, config)
+        self.config = config
+        return True
+
+    def save_api_map(self, api_map) -> tuple:
+        """Writes API files whose json is not the one last loaded or
+        saved, and removes files which are not in the API map anymore.
+        Returns (written file names, removed file names)"""
+
+        written, removed = [], []
+        names = set()
+        for api, name in api_map:
+            names.add(name)
+            if self._apis.get(name) is not api:
+                self._write(os.path.join(self.api_rules_dir, name), api)
+                self._apis[name] = api
+                written.append(name)
+
+        for name in list(self._apis):
+            if name not in names:
+                path = os.path.join(self.api_rules_dir, name)
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                del self._apis[name]
+                self._signatures.pop(path, None)
+                removed.append(name)
+
+        self._apis = {name: api for api, name in api_map}
+        self.api_map = list(api_map)
+        return written, removed